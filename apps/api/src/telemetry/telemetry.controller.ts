@@ -1,6 +1,6 @@
 import { Controller, Post, Body, UseGuards, Get, Query } from '@nestjs/common';
 import { TelemetryService } from './telemetry.service';
-import { CreateAiUsageEventDto, UsageSummaryResponseDto } from './telemetry.dto';
+import { CreateAiUsageBatchDto, CreateAiUsageEventDto, UsageSummaryResponseDto } from './telemetry.dto';
 import { InternalServiceGuard } from '../auth/internal-service.guard';
 import { JwtAuthGuard } from '../common/guards/jwt-auth.guard';
 import { CurrentUser } from '../common/decorators/current-user.decorator';
@@ -21,6 +21,13 @@ export class TelemetryController {
         return { id: event.id, createdAt: event.createdAt };
     }
 
+    @Post('ai-usage/batch')
+    @UseGuards(InternalServiceGuard)
+    @ApiOperation({ summary: 'Registrar un lote de eventos de uso de IA (servicio interno)' })
+    async createInternalBatch(@Body() dto: CreateAiUsageBatchDto) {
+        return this.telemetryService.createManyFromInternal(dto);
+    }
+
     @Get('usage-summary')
     @UseGuards(JwtAuthGuard)
     @ApiBearerAuth()
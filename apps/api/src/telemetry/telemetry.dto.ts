@@ -1,5 +1,5 @@
 import { ApiProperty, ApiPropertyOptional } from '@nestjs/swagger';
-import { IsEnum, IsInt, IsNumber, IsOptional, IsString, IsObject } from 'class-validator';
+import { ArrayMaxSize, IsArray, IsEnum, IsInt, IsNumber, IsOptional, IsString, IsObject } from 'class-validator';
 import { AiProvider, TelemetryFeature } from '@leximetrics/db';
 
 export class CreateAiUsageEventDto {
@@ -62,6 +62,23 @@ export class CreateAiUsageEventDto {
     metadata?: Record<string, any>;
 }
 
+export class CreateAiUsageBatchDto {
+    // Cada evento se valida por separado en el service: uno inválido no rechaza el lote
+    @ApiProperty({ type: [CreateAiUsageEventDto] })
+    @IsArray()
+    @ArrayMaxSize(500)
+    @IsObject({ each: true })
+    events: Record<string, any>[];
+}
+
+export class AiUsageBatchResponseDto {
+    @ApiProperty()
+    count: number;
+
+    @ApiProperty({ description: 'Eventos descartados: posición en el lote y motivo' })
+    rejected: { index: number; reason: string }[];
+}
+
 export class UsageSummaryResponseDto {
     @ApiProperty()
     from: string;
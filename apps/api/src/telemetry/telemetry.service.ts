@@ -1,6 +1,8 @@
 import { Injectable, BadRequestException } from '@nestjs/common';
 import { PrismaService } from '../prisma/prisma.service';
-import { CreateAiUsageEventDto, UsageSummaryResponseDto } from './telemetry.dto';
+import { plainToInstance } from 'class-transformer';
+import { validate } from 'class-validator';
+import { AiUsageBatchResponseDto, CreateAiUsageBatchDto, CreateAiUsageEventDto, UsageSummaryResponseDto } from './telemetry.dto';
 import { AiUsageEvent, TelemetryFeature, AiProvider } from '@leximetrics/db';
 
 @Injectable()
@@ -13,26 +15,60 @@ export class TelemetryService {
         }
 
         const event = await this.prisma.aiUsageEvent.create({
-            data: {
-                tenantId: dto.tenantId,
-                userId: dto.userId || null,
-                feature: dto.feature,
-                provider: dto.provider,
-                model: dto.model,
-                tokensPrompt: dto.tokensPrompt,
-                tokensCompletion: dto.tokensCompletion,
-                tokensTotal: dto.tokensTotal,
-                costUsd: dto.costUsd,
-                latencyMs: dto.latencyMs ?? null,
-                correlationId: dto.correlationId ?? null,
-                source: dto.source ?? null,
-                metadata: dto.metadata ?? {},
-            },
+            data: this.toEventData(dto),
         });
 
         return event;
     }
 
+    async createManyFromInternal(dto: CreateAiUsageBatchDto): Promise<AiUsageBatchResponseDto> {
+        const valid: CreateAiUsageEventDto[] = [];
+        const rejected: { index: number; reason: string }[] = [];
+
+        // Validación evento por evento (mismas reglas que el ValidationPipe global)
+        for (const [index, raw] of dto.events.entries()) {
+            const event = plainToInstance(CreateAiUsageEventDto, raw);
+            const errors = await validate(event, { whitelist: true, forbidNonWhitelisted: true });
+            if (errors.length > 0) {
+                const reason = errors.flatMap(e => Object.values(e.constraints ?? {})).join('; ');
+                rejected.push({ index, reason });
+            } else if (!event.tenantId) {
+                rejected.push({ index, reason: 'tenantId es obligatorio para registrar telemetría interna' });
+            } else {
+                valid.push(event);
+            }
+        }
+
+        if (valid.length === 0) {
+            return { count: 0, rejected };
+        }
+
+        // Un solo INSERT para los eventos válidos del lote enviado por el shipper del ai-service
+        const result = await this.prisma.aiUsageEvent.createMany({
+            data: valid.map(event => this.toEventData(event)),
+        });
+
+        return { count: result.count, rejected };
+    }
+
+    private toEventData(dto: CreateAiUsageEventDto) {
+        return {
+            tenantId: dto.tenantId as string,
+            userId: dto.userId || null,
+            feature: dto.feature,
+            provider: dto.provider,
+            model: dto.model,
+            tokensPrompt: dto.tokensPrompt,
+            tokensCompletion: dto.tokensCompletion,
+            tokensTotal: dto.tokensTotal,
+            costUsd: dto.costUsd,
+            latencyMs: dto.latencyMs ?? null,
+            correlationId: dto.correlationId ?? null,
+            source: dto.source ?? null,
+            metadata: dto.metadata ?? {},
+        };
+    }
+
     async getUsageSummary(
         tenantId: string,
         from?: string,
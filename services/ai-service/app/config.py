@@ -1,5 +1,5 @@
 import os
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -12,11 +12,92 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = os.environ.get("OPENAI_API_KEY", "dummy_key_for_build")
     MODEL_NAME: str = "gemini-2.0-flash"
     GEMINI_ENDPOINT: str = "https://generativelanguage.googleapis.com/v1beta/models"
+    GEMINI_TIMEOUT_SECONDS: float = 30.0  # deadline por llamada, incluidos reintentos
+    GEMINI_MAX_RETRIES: int = 3
+    GEMINI_BACKOFF_BASE_SECONDS: float = 0.5
+    GEMINI_BACKOFF_MAX_SECONDS: float = 8.0
+    GEMINI_MAX_CONNECTIONS: int = 20
+    GEMINI_HTTP2: bool = True
+
+    # Cache de respuestas de LLM por hash del prompt (solo llamadas de baja temperatura)
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_DB_PATH: str = "./llm_cache.db"
+    LLM_CACHE_TTL_SECONDS: int = 30 * 86400
+    LLM_CACHE_MAX_ENTRIES: int = 10000
+    LLM_CACHE_MAX_TEMPERATURE: float = 0.2
 
     # ChromaDB & RAG
     CHROMA_PERSIST_DIR: str = "./chroma_db"
     EMBEDDING_MODEL: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    EMBEDDING_BACKEND: str = "torch"  # torch | onnx
+    EMBEDDING_ONNX_DIR: str = "./models/embeddings-onnx"
+    EMBEDDING_ONNX_QUANTIZE: bool = True
+    EMBEDDING_ONNX_THREADS: int = 0  # 0 = default de onnxruntime
+    EMBEDDING_STORE_ENABLED: bool = True
+    EMBEDDING_STORE_PATH: str = "./embedding_store.db"
     TOP_K_RESULTS: int = 5
+    KB_QUERY_MAX_WORKERS: int = 5
+    HYBRID_SEARCH_ENABLED: bool = True
+    RRF_K: int = 60
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1024
+
+    # Empaquetado del contexto del prompt (tokens estimados por modelo)
+    CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {
+        "gemini-2.0-flash": 6000,
+        "gemini-1.5-flash": 6000,
+        "gemini-1.5-pro": 12000,
+    }
+    CONTEXT_TOKEN_BUDGET_DEFAULT: int = 4000
+    CONTEXT_CHARS_PER_TOKEN: float = 4.0
+    CONTEXT_MIN_CHUNK_TOKENS: int = 60
+    CONTEXT_DEDUP_THRESHOLD: float = 0.8  # fracción de shingles ya cubiertos para descartar un chunk
+
+    # Cache semántico de respuestas (/ask)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_DB_PATH: str = "./answer_cache.db"
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.93
+    ANSWER_CACHE_TTL_SECONDS: int = 7 * 86400
+    ANSWER_CACHE_MAX_ENTRIES: int = 5000
+    ANSWER_CACHE_KB_CHECK_SECONDS: float = 30.0
+
+    # External search cache (PJUD / BCN / SciELO)
+    EXTERNAL_CACHE_DB_PATH: str = "./external_cache.db"
+    EXTERNAL_CACHE_SEMANTIC_FALLBACK: bool = False
+    EXTERNAL_CACHE_SIMILARITY_THRESHOLD: float = 0.92
+    EXTERNAL_CACHE_STALE_WHILE_REVALIDATE: bool = True
+    EXTERNAL_CACHE_STALE_GRACE_DAYS: int = 7
+    EXTERNAL_CACHE_NEGATIVE_TTL_SECONDS: int = 3600  # búsquedas sin resultados
+    EXTERNAL_CACHE_ERROR_TTL_SECONDS: int = 300  # timeouts / errores del scraper
+    EXTERNAL_CACHE_RATE_LIMIT_TTL_SECONDS: int = 900
+    EXTERNAL_CACHE_MAX_ENTRIES: int = 5000
+    EXTERNAL_CACHE_SWEEP_INTERVAL_SECONDS: int = 600
+    EXTERNAL_CACHE_SWEEP_BATCH: int = 500
+
+    # Thread pools para trabajo bloqueante fuera del event loop (0 = nº de CPUs)
+    CPU_EXECUTOR_WORKERS: int = 0
+    IO_EXECUTOR_WORKERS: int = 16
+
+    # Presupuesto de latencia de la búsqueda multi-fuente (segundos)
+    SEARCH_BUDGET_SECONDS: float = 8.0
+    SOURCE_DEADLINES_SECONDS: Dict[str, float] = {
+        "local": 3.0,
+        "pjud": 6.0,
+        "bcn": 4.0,
+        "scielo": 4.0,
+    }
+
+    # Ruteo de fuentes según el área de la pregunta (ver source_router)
+    SOURCE_ROUTING_ENABLED: bool = True
+    SOURCE_ROUTING_MIN_UTILITY: float = 0.3
+    SOURCE_ROUTING_LATENCY_PENALTY: float = 0.3
+    SOURCE_ROUTING_MIN_LOCAL: int = 2
+
+    # Circuit breaker de fuentes externas
+    CIRCUIT_BREAKER_WINDOW_SECONDS: float = 120.0
+    CIRCUIT_BREAKER_MIN_CALLS: int = 5
+    CIRCUIT_BREAKER_FAILURE_RATE: float = 0.5
+    CIRCUIT_BREAKER_SLOW_CALL_SECONDS: float = 15.0
+    CIRCUIT_BREAKER_OPEN_SECONDS: float = 60.0
 
     # TTS
     TTS_ENABLED: bool = True
@@ -31,6 +112,23 @@ class Settings(BaseSettings):
     # Telemetry
     TELEMETRY_ENABLED: bool = True
     TELEMETRY_DB_PATH: str = "./jarvis_telemetry.db"
+    TELEMETRY_QUEUE_SIZE: int = 10000  # escrituras pendientes antes de descartar
+    TELEMETRY_BATCH_SIZE: int = 200  # eventos por transacción
+    TELEMETRY_FLUSH_INTERVAL_SECONDS: float = 1.0
+    SOURCE_WEIGHTS_TTL_SECONDS: float = 600.0  # recarga completa aunque no cambie la versión
+    SOURCE_WEIGHTS_VERSION_CHECK_SECONDS: float = 15.0  # cada cuánto se mira el contador de versión
+    SOURCE_WEIGHT_LEARNER_ENABLED: bool = True
+    SOURCE_WEIGHT_LEARNER_INTERVAL_SECONDS: int = 60
+    SOURCE_WEIGHT_LEARNER_BATCH: int = 1000  # feedbacks por transacción
+    SOURCE_WEIGHT_HALF_LIFE_DAYS: float = 30.0  # el feedback pierde la mitad de su peso en este plazo
+    SOURCE_WEIGHT_MIN_AREA_SAMPLES: float = 5.0
+    # Envío de uso de IA al API core (lotes, reintentos, spool en disco)
+    AI_USAGE_QUEUE_SIZE: int = 5000  # eventos en memoria; si se llena, van directo al spool
+    AI_USAGE_BATCH_SIZE: int = 100  # eventos por POST (el API core acepta hasta 500)
+    AI_USAGE_FLUSH_INTERVAL_SECONDS: float = 2.0
+    AI_USAGE_MAX_RETRIES: int = 4
+    AI_USAGE_SPOOL_PATH: str = "./ai_usage_spool.jsonl"
+    AI_USAGE_DRAIN_TIMEOUT_SECONDS: float = 10.0
 
     class Config:
         env_file = ".env"
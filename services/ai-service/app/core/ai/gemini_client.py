@@ -1,48 +1,78 @@
-import requests
+import asyncio
+import json
 import logging
-from typing import List, Dict, Any
+import random
+import time
+from collections import deque
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+import httpx
+
 from app.config import settings
+from app.core.ai.llm_cache import llm_cache, llm_cache_key
+from app.core.executors import io_executor
 
 logger = logging.getLogger(__name__)
 
+# Status HTTP que vale la pena reintentar (rate limit y errores transitorios del servidor)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class GeminiError(Exception):
+    """Error al llamar a la API de Gemini (status no reintentable o respuesta inválida)."""
+    pass
+
+class GeminiTimeoutError(GeminiError):
+    """Se agotó el deadline de la llamada, incluidos los reintentos."""
+    pass
+
 class GeminiClient:
     """
-    Cliente para interactuar con la API REST de Gemini 2.0 Flash.
-    Encapsula la lógica de llamadas HTTP y manejo de errores.
+    Cliente async para la API REST de Gemini 2.0 Flash.
+    Usa un httpx.AsyncClient compartido (HTTP/2, pool de conexiones con
+    keep-alive), reintenta 429/5xx con backoff exponencial con jitter dentro
+    de un deadline por llamada y registra la latencia de cada intento.
     """
     def __init__(self):
         self.api_key = settings.GEMINI_API_KEY
         self.model_name = settings.MODEL_NAME
         self.base_url = settings.GEMINI_ENDPOINT
+        self.max_retries = settings.GEMINI_MAX_RETRIES
+        self.backoff_base = settings.GEMINI_BACKOFF_BASE_SECONDS
+        self.backoff_max = settings.GEMINI_BACKOFF_MAX_SECONDS
+        self.default_deadline = settings.GEMINI_TIMEOUT_SECONDS
+        self._client: Optional[httpx.AsyncClient] = None
 
-    def generate(self, system_prompt: str, user_prompt: str, max_tokens: int = 2048, temperature: float = 0.7) -> str:
-        """
-        Genera contenido usando el modelo Gemini.
-        
-        Args:
-            system_prompt: Instrucciones del sistema.
-            user_prompt: Consulta del usuario.
-            max_tokens: Límite de tokens de salida.
-            temperature: Creatividad (0.0 a 1.0).
-            
-        Returns:
-            Texto generado por el modelo.
-        """
-        url = f"{self.base_url}/{self.model_name}:generateContent?key={self.api_key}"
-        
-        # Construcción del payload para Gemini
+        # Últimos intentos: {"attempt", "status", "latency_ms", "outcome"}
+        self.attempts: deque = deque(maxlen=500)
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=settings.GEMINI_HTTP2,
+                limits=httpx.Limits(
+                    max_connections=settings.GEMINI_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.GEMINI_MAX_CONNECTIONS,
+                ),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _build_payload(self, system_prompt: str, user_prompt: str, max_tokens: int, temperature: float) -> Dict[str, Any]:
         # Nota: Gemini API v1beta usa 'contents' para el historial y 'systemInstruction' (en algunos modelos)
-        # Para simplificar y compatibilidad general, a veces se inyecta system prompt en el primer mensaje.
-        # Pero Gemini 1.5/2.0 soporta system_instruction.
-        
-        payload = {
+        # Para simplificar y compatibilidad general, se inyecta el system prompt en el primer mensaje.
+        return {
             "contents": [
                 {
                     "role": "user",
-                    "parts": [{"text": f"{system_prompt}\n\nUser Query: {user_prompt}"}] 
-                    # Simplificación: concatenamos system y user si la API específica de systemInstruction da problemas,
-                    # pero lo ideal es usar el campo systemInstruction si está disponible.
-                    # Probemos estructura estándar de chat.
+                    "parts": [{"text": f"{system_prompt}\n\nUser Query: {user_prompt}"}]
                 }
             ],
             "generationConfig": {
@@ -51,29 +81,211 @@ class GeminiClient:
             }
         }
 
-        headers = {
-            "Content-Type": "application/json"
-        }
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter: uniforme entre 0 y el tope exponencial
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, cap)
 
-        try:
-            response = requests.post(url, json=payload, headers=headers)
-            
-            if response.status_code >= 400:
-                logger.error(f"Gemini API Error ({response.status_code}): {response.text}")
-                raise Exception(f"Gemini API returned status {response.status_code}")
+    def _record_attempt(self, attempt: int, status: Optional[int], started: float, outcome: str) -> None:
+        latency_ms = int((time.perf_counter() - started) * 1000)
+        self.attempts.append({"attempt": attempt, "status": status, "latency_ms": latency_ms, "outcome": outcome})
+        logger.debug(f"Gemini attempt {attempt}: status={status} outcome={outcome} latency={latency_ms}ms")
+
+    async def post_with_retries(self, url: str, payload: Dict[str, Any], deadline_seconds: Optional[float] = None) -> httpx.Response:
+        """
+        POST con reintentos (429/5xx/errores de red) dentro de un deadline total.
+        Devuelve la respuesta exitosa o lanza GeminiError / GeminiTimeoutError.
+        """
+        client = self._get_client()
+        deadline = time.monotonic() + (deadline_seconds or self.default_deadline)
+        self.calls += 1
+        last_error: Optional[str] = None
+
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                response = await client.post(url, json=payload, timeout=remaining)
+            except httpx.TimeoutException as e:
+                self._record_attempt(attempt, None, started, "timeout")
+                last_error = f"timeout: {e}"
+            except httpx.TransportError as e:
+                self._record_attempt(attempt, None, started, "network_error")
+                last_error = f"network error: {e}"
+            else:
+                if response.status_code < 400:
+                    self._record_attempt(attempt, response.status_code, started, "ok")
+                    return response
+                if response.status_code not in RETRYABLE_STATUS:
+                    self._record_attempt(attempt, response.status_code, started, "error")
+                    self.failures += 1
+                    logger.error(f"Gemini API Error ({response.status_code}): {response.text}")
+                    raise GeminiError(f"Gemini API returned status {response.status_code}")
+                self._record_attempt(attempt, response.status_code, started, "retryable")
+                last_error = f"status {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt == self.max_retries:
+                break
+            delay = self._backoff(attempt, retry_after)
+            if time.monotonic() + delay >= deadline:
+                break
+            self.retries += 1
+            logger.warning(f"Gemini attempt {attempt} failed ({last_error}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
 
+        self.failures += 1
+        if time.monotonic() >= deadline or (last_error or "").startswith("timeout"):
+            raise GeminiTimeoutError(f"Gemini call exceeded its deadline ({last_error})")
+        raise GeminiError(f"Gemini call failed after {self.max_retries + 1} attempts ({last_error})")
+
+    async def generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = 2048,
+        temperature: float = 0.7,
+        deadline_seconds: Optional[float] = None,
+    ) -> str:
+        """
+        Genera contenido usando el modelo Gemini.
+
+        Args:
+            system_prompt: Instrucciones del sistema.
+            user_prompt: Consulta del usuario.
+            max_tokens: Límite de tokens de salida.
+            temperature: Creatividad (0.0 a 1.0).
+            deadline_seconds: Tiempo total máximo, incluidos reintentos.
+
+        Returns:
+            Texto generado por el modelo.
+        """
+        url = f"{self.base_url}/{self.model_name}:generateContent?key={self.api_key}"
+        payload = self._build_payload(system_prompt, user_prompt, max_tokens, temperature)
+
+        # Llamadas casi deterministas: mismo prompt -> misma respuesta, sin pagar otra vez
+        cache_key = None
+        if llm_cache.is_cacheable(temperature):
+            cache_key = llm_cache_key("gemini", self.model_name, payload["contents"], temperature, None, max_tokens=max_tokens)
+            cached = await io_executor.run(llm_cache.get, cache_key)
+            if cached is not None:
+                return cached
+
+        try:
+            response = await self.post_with_retries(url, payload, deadline_seconds)
             data = response.json()
-            
+
             # Extraer texto
             try:
                 text = data["candidates"][0]["content"]["parts"][0]["text"]
-                return text
-            except (KeyError, IndexError) as e:
+            except (KeyError, IndexError):
                 logger.error(f"Error parsing Gemini response: {data}")
-                raise Exception("Invalid response format from Gemini API")
+                raise GeminiError("Invalid response format from Gemini API")
+            if cache_key is not None:
+                await io_executor.run(llm_cache.set, cache_key, "gemini", self.model_name, text)
+            return text
 
         except Exception as e:
             logger.error(f"Error calling Gemini: {e}")
             raise
 
+    async def generate_stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = 2048,
+        temperature: float = 0.7,
+        deadline_seconds: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Igual que `generate`, pero vía streamGenerateContent (SSE) y entrega
+        los fragmentos de texto a medida que llegan. Solo se reintenta mientras
+        no se haya emitido ningún fragmento; después un error se propaga.
+        """
+        url = f"{self.base_url}/{self.model_name}:streamGenerateContent?alt=sse&key={self.api_key}"
+        payload = self._build_payload(system_prompt, user_prompt, max_tokens, temperature)
+        client = self._get_client()
+        deadline = time.monotonic() + (deadline_seconds or self.default_deadline)
+        self.calls += 1
+        last_error: Optional[str] = None
+
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            started = time.perf_counter()
+            retry_after = None
+            emitted = False
+            try:
+                async with client.stream("POST", url, json=payload, timeout=remaining) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        if response.status_code not in RETRYABLE_STATUS:
+                            self._record_attempt(attempt, response.status_code, started, "error")
+                            self.failures += 1
+                            logger.error(f"Gemini API Error ({response.status_code}): {response.text}")
+                            raise GeminiError(f"Gemini API returned status {response.status_code}")
+                        self._record_attempt(attempt, response.status_code, started, "retryable")
+                        last_error = f"status {response.status_code}"
+                        retry_after = response.headers.get("Retry-After")
+                    else:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            try:
+                                chunk = json.loads(line[5:].strip())
+                                text = chunk["candidates"][0]["content"]["parts"][0]["text"]
+                            except (ValueError, KeyError, IndexError):
+                                # Chunks sin texto (p.ej. solo finishReason / usageMetadata)
+                                continue
+                            if time.monotonic() > deadline:
+                                self._record_attempt(attempt, response.status_code, started, "timeout")
+                                self.failures += 1
+                                raise GeminiTimeoutError("Gemini stream exceeded its deadline")
+                            emitted = True
+                            yield text
+                        self._record_attempt(attempt, response.status_code, started, "ok")
+                        return
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                outcome = "timeout" if isinstance(e, httpx.TimeoutException) else "network_error"
+                self._record_attempt(attempt, None, started, outcome)
+                if emitted:
+                    self.failures += 1
+                    raise GeminiError(f"Gemini stream interrupted ({outcome}: {e})")
+                last_error = f"{outcome}: {e}"
+
+            if attempt == self.max_retries:
+                break
+            delay = self._backoff(attempt, retry_after)
+            if time.monotonic() + delay >= deadline:
+                break
+            self.retries += 1
+            logger.warning(f"Gemini stream attempt {attempt} failed ({last_error}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        self.failures += 1
+        if time.monotonic() >= deadline or (last_error or "").startswith("timeout"):
+            raise GeminiTimeoutError(f"Gemini stream exceeded its deadline ({last_error})")
+        raise GeminiError(f"Gemini stream failed after {self.max_retries + 1} attempts ({last_error})")
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(a["latency_ms"] for a in self.attempts)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "recent_attempts": len(latencies),
+            "p50_attempt_latency_ms": latencies[len(latencies) // 2] if latencies else None,
+        }
+
 gemini_client = GeminiClient()
@@ -0,0 +1,74 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class BoundedExecutor:
+    """
+    Pool de threads acotado para sacar trabajo bloqueante del event loop.
+    Lleva contadores de tareas en cola / en ejecución para exportarlos como métricas.
+    """
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self.completed = 0
+        self.max_queue_depth = 0
+
+    def _wrap(self, fn: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self.completed += 1
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Ejecuta `fn(*args, **kwargs)` en el pool y espera su resultado."""
+        with self._lock:
+            self._queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queued)
+        future = self._pool.submit(functools.partial(self._wrap, fn, *args, **kwargs))
+        future.add_done_callback(self._on_done)
+        # Cancelar el await (deadline, shutdown) cancela el future si aún no empezó
+        return await asyncio.wrap_future(future)
+
+    def _on_done(self, future: Future) -> None:
+        # Cancelado antes de empezar: _wrap nunca corrió, el descuento va acá
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queued,
+                "active": self._active,
+                "completed": self.completed,
+                "max_queue_depth": self.max_queue_depth,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# CPU: encode de embeddings, consultas a Chroma / BM25
+cpu_executor = BoundedExecutor("cpu", settings.CPU_EXECUTOR_WORKERS or (os.cpu_count() or 2))
+# IO: SQLite (telemetría, caches), HTTP bloqueante
+io_executor = BoundedExecutor("io", settings.IO_EXECUTOR_WORKERS)
+
+def executor_stats() -> Dict[str, Dict[str, int]]:
+    return {"cpu": cpu_executor.stats(), "io": io_executor.stats()}
@@ -0,0 +1,117 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Buckets fijos (segundos): de 1 ms (cache / SQLite) a 30 s (scrapers, Gemini)
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+class Histogram:
+    """
+    Histograma con buckets fijos por combinación de labels. Cada observación
+    es un bisect + un incremento bajo lock; se exporta en formato Prometheus.
+    """
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label key -> [conteos por bucket (+Inf al final), suma, total]
+        self._series: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(s[0]), s[1], s[2]) for key, s in sorted(self._series.items())]
+        for key, counts, total_sum, count in snapshot:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total_sum:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class Counter:
+    """Contador monótono por combinación de labels."""
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {value:g}" for key, value in snapshot)
+        return lines
+
+def _render_samples(name: str, help_text: str, kind: str, samples: List[Tuple[Dict[str, str], float]]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_format_labels(_label_key(labels))} {value:g}" for labels, value in samples)
+    return lines
+
+def render_gauges(name: str, help_text: str, samples: List[Tuple[Dict[str, str], float]]) -> List[str]:
+    """Gauges calculados al momento del scrape (ratios de cache, colas, etc.)."""
+    return _render_samples(name, help_text, "gauge", samples)
+
+def render_counters(name: str, help_text: str, samples: List[Tuple[Dict[str, str], float]]) -> List[str]:
+    """Contadores monótonos que llevan otros componentes (Gemini, telemetría); `name` debe terminar en _total."""
+    return _render_samples(name, help_text, "counter", samples)
+
+stage_duration = Histogram(
+    "jarvis_stage_duration_seconds",
+    "Duración de cada etapa del pipeline RAG.",
+)
+source_requests = Counter(
+    "jarvis_source_requests_total",
+    "Búsquedas por fuente y resultado (ok, timeout, circuit_open, cached_miss, error).",
+)
+cache_requests = Counter(
+    "jarvis_cache_requests_total",
+    "Lookups de cache por cache y resultado (hit, miss, stale, negative).",
+)
+
+@contextmanager
+def span(stage: str, **labels: str) -> Iterator[None]:
+    """Mide la duración de un bloque (sync o con awaits adentro) en stage_duration."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - start, stage=stage, **labels)
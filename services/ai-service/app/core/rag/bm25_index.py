@@ -0,0 +1,165 @@
+import logging
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SQL_BATCH = 500
+
+# Tokens tipo "18.010", "c-123-2024", "1698", "art"
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+_STOPWORDS = {
+    "a", "al", "ante", "con", "como", "cual", "de", "del", "el", "en", "es", "esta", "este",
+    "la", "las", "lo", "los", "o", "para", "pero", "por", "que", "se", "si", "sin", "sobre",
+    "su", "sus", "un", "una", "uno", "y", "le", "les", "mi", "me", "ya", "no", "hay",
+}
+
+
+def _strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenizador léxico orientado a textos jurídicos.
+    Conserva identificadores exactos ("18.010" -> "18010", "c-123-2024") y
+    además emite sus partes, para que "ROL 123-2024" calce con "C-123-2024".
+    """
+    tokens = []
+    for raw in _TOKEN_RE.findall(_strip_accents(text.lower())):
+        if raw in _STOPWORDS:
+            continue
+        # Los números con separador de miles se indexan sin puntos
+        if re.fullmatch(r"\d{1,3}(?:\.\d{3})+", raw):
+            tokens.append(raw.replace(".", ""))
+            continue
+        tokens.append(raw)
+        parts = re.split(r"[.\-/]", raw)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p and p not in _STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 persistido en SQLite, con una partición por colección.
+    Se actualiza incrementalmente (upsert/delete por id de documento).
+    """
+    def __init__(self, db_path: str, k1: float = 1.5, b: float = 0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bm25_doc (
+                collection TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (collection, doc_id)
+            );
+            CREATE TABLE IF NOT EXISTS bm25_posting (
+                collection TEXT NOT NULL,
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_bm25_posting_term ON bm25_posting (collection, term);
+            CREATE INDEX IF NOT EXISTS idx_bm25_posting_doc ON bm25_posting (collection, doc_id);
+        """)
+        self._conn.commit()
+
+    def _delete_locked(self, collection: str, ids: List[str]) -> None:
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(
+                f"DELETE FROM bm25_posting WHERE collection = ? AND doc_id IN ({placeholders})",
+                [collection, *batch],
+            )
+            self._conn.execute(
+                f"DELETE FROM bm25_doc WHERE collection = ? AND doc_id IN ({placeholders})",
+                [collection, *batch],
+            )
+
+    def upsert(self, collection: str, ids: List[str], texts: List[str]) -> None:
+        """Indexa (o re-indexa) documentos de una colección."""
+        if not ids:
+            return
+        doc_rows = []
+        posting_rows = []
+        for doc_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text or ""))
+            doc_rows.append((collection, doc_id, sum(counts.values())))
+            posting_rows.extend((collection, term, doc_id, tf) for term, tf in counts.items())
+
+        with self._lock:
+            self._delete_locked(collection, list(ids))
+            self._conn.executemany(
+                "INSERT INTO bm25_doc (collection, doc_id, length) VALUES (?, ?, ?)", doc_rows
+            )
+            self._conn.executemany(
+                "INSERT INTO bm25_posting (collection, term, doc_id, tf) VALUES (?, ?, ?, ?)", posting_rows
+            )
+            self._conn.commit()
+
+    def delete(self, collection: str, ids: List[str]) -> None:
+        if not ids:
+            return
+        with self._lock:
+            self._delete_locked(collection, list(ids))
+            self._conn.commit()
+
+    def search(self, collection: str, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Devuelve [(doc_id, score_bm25)] ordenado de mayor a menor."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            n_docs, avg_len = self._conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM bm25_doc WHERE collection = ?", (collection,)
+            ).fetchone()
+            if not n_docs:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            rows = self._conn.execute(
+                f"""
+                SELECT p.term, p.doc_id, p.tf, d.length
+                FROM bm25_posting p
+                JOIN bm25_doc d ON d.collection = p.collection AND d.doc_id = p.doc_id
+                WHERE p.collection = ? AND p.term IN ({placeholders})
+                """,
+                [collection, *terms],
+            ).fetchall()
+
+        postings: Dict[str, List[Tuple[str, int, int]]] = defaultdict(list)
+        for term, doc_id, tf, length in rows:
+            postings[term].append((doc_id, tf, length))
+
+        avg_len = avg_len or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        for term, plist in postings.items():
+            df = len(plist)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf, length in plist:
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+    def count(self, collection: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM bm25_doc WHERE collection = ?", (collection,)
+            ).fetchone()[0]
@@ -0,0 +1,179 @@
+import math
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+
+# Campos de metadata que aportan al LLM, por fuente. El resto (ids internos,
+# flags de cache, scores) es ruido en el prompt.
+METADATA_KEYS: Dict[str, Tuple[str, ...]] = {
+    "pjud": ("rol", "caratulado", "fecha", "sala", "resultado", "url"),
+    "bcn": ("tipo", "numero", "titulo", "anio", "url"),
+    "scielo": ("titulo", "autores", "revista", "anio", "url_html"),
+}
+DEFAULT_METADATA_KEYS: Tuple[str, ...] = ("source", "titulo", "title", "autor", "author", "libro", "articulo", "rol", "url")
+MAX_METADATA_VALUE_CHARS = 120
+
+SHINGLE_SIZE = 5
+MIN_OVERLAP_WORDS = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata de tokens (chars / CONTEXT_CHARS_PER_TOKEN)."""
+    if not text:
+        return 0
+    return max(1, math.ceil(len(text) / settings.CONTEXT_CHARS_PER_TOKEN))
+
+
+def token_budget_for(model_name: str) -> int:
+    return settings.CONTEXT_TOKEN_BUDGETS.get(model_name, settings.CONTEXT_TOKEN_BUDGET_DEFAULT)
+
+
+def _format_metadata(source: str, meta: Dict[str, Any], document: str) -> str:
+    """Solo campos relevantes de la fuente y que no estén ya en el texto del chunk."""
+    parts = []
+    doc_lower = document.casefold()
+    for key in METADATA_KEYS.get(source, DEFAULT_METADATA_KEYS):
+        value = meta.get(key)
+        if value in (None, "", []):
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ", ".join(str(v) for v in value)
+        value = str(value)[:MAX_METADATA_VALUE_CHARS]
+        if value.casefold() in doc_lower:
+            continue
+        parts.append(f"{key}:{value}")
+    return ", ".join(parts)
+
+
+def _shingles(words: List[str]) -> Set[Tuple[str, ...]]:
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _overlap(left: List[str], right: List[str]) -> int:
+    """Largo (en palabras) del sufijo de `left` que es prefijo de `right`."""
+    max_k = min(len(left), len(right))
+    for k in range(max_k, MIN_OVERLAP_WORDS - 1, -1):
+        if left[-k:] == right[:k]:
+            return k
+    return 0
+
+
+def _trim_overlaps(words: List[str], kept: List[List[str]]) -> List[str]:
+    """Quita el solapamiento con ventanas vecinas ya incluidas (chunks con overlap de ingesta)."""
+    for other in kept:
+        k = _overlap(other, words)
+        if k:
+            words = words[k:]
+        k = _overlap(words, other)
+        if k:
+            words = words[:-k]
+    return words
+
+
+def _allocate(needs: List[int], weights: List[float], available: int) -> List[int]:
+    """
+    Reparte `available` tokens proporcional a `weights` sin dar a nadie más
+    de lo que necesita; lo que sobra se redistribuye (water-filling).
+    """
+    alloc = [0] * len(needs)
+    pending = set(range(len(needs)))
+    while pending and available > 0:
+        total_weight = sum(weights[i] for i in pending)
+        satisfied = [i for i in pending if needs[i] <= available * weights[i] / total_weight]
+        if not satisfied:
+            for i in pending:
+                alloc[i] = int(available * weights[i] / total_weight)
+            break
+        for i in satisfied:
+            alloc[i] = needs[i]
+            available -= needs[i]
+            pending.discard(i)
+    return alloc
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = int(max_tokens * settings.CONTEXT_CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+def pack_context(results: List[Dict[str, Any]], model_name: Optional[str] = None, token_budget: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Arma el bloque de contexto del prompt dentro de un presupuesto de tokens.
+
+    - Descarta chunks casi duplicados y recorta solapamientos entre ventanas.
+    - Reparte el presupuesto según adjusted_score (el mejor chunk puede ir completo).
+    - Deja solo la metadata relevante de cada fuente.
+
+    Returns:
+        {"text", "sources", "tokens_used", "token_budget", "dropped"}
+        donde `sources` son los resultados que efectivamente entraron al contexto.
+    """
+    budget = token_budget or token_budget_for(model_name or settings.MODEL_NAME)
+    seen: Set[Tuple[str, ...]] = set()
+    kept_words: List[List[str]] = []
+    candidates = []
+    dropped = {"duplicate": 0, "budget": 0}
+
+    for r in results:
+        words = (r.get("document") or "").split()
+        shingles = _shingles(words)
+        if shingles and len(shingles & seen) / len(shingles) >= settings.CONTEXT_DEDUP_THRESHOLD:
+            dropped["duplicate"] += 1
+            continue
+        seen |= shingles
+        trimmed = _trim_overlaps(words, kept_words)
+        kept_words.append(words)
+        if not trimmed:
+            dropped["duplicate"] += 1
+            continue
+
+        source = r.get("source_type", "unknown")
+        score = r.get("adjusted_score", r.get("score", 0.0)) or 0.0
+        body = " ".join(trimmed)
+        meta_str = _format_metadata(source, r.get("metadata") or {}, body)
+        header = f"FUENTE: {source} (score={score:.2f})"
+        if meta_str:
+            header += f"\nMETADATA: {meta_str}"
+        candidates.append({
+            "result": r,
+            "header": header,
+            "body": body,
+            "weight": max(score, 1e-3),
+            "header_tokens": estimate_tokens(f"{header}\nCONTENIDO: \n\n"),
+            "need": estimate_tokens(body),
+        })
+
+    # Se descarta el chunk de menor score hasta que todos alcancen el mínimo útil
+    while candidates:
+        available = budget - sum(c["header_tokens"] for c in candidates)
+        alloc = _allocate([c["need"] for c in candidates], [c["weight"] for c in candidates], max(available, 0))
+        starved = [
+            i for i, c in enumerate(candidates)
+            if alloc[i] < min(c["need"], settings.CONTEXT_MIN_CHUNK_TOKENS)
+        ]
+        if not starved:
+            break
+        worst = min(starved, key=lambda i: candidates[i]["weight"])
+        candidates.pop(worst)
+        dropped["budget"] += 1
+
+    parts = []
+    for c, tokens in zip(candidates, alloc if candidates else []):
+        parts.append(f"{c['header']}\nCONTENIDO: {_truncate(c['body'], tokens)}")
+    text = "\n\n".join(parts)
+
+    return {
+        "text": text,
+        "sources": [c["result"] for c in candidates],
+        "tokens_used": estimate_tokens(text),
+        "token_budget": budget,
+        "dropped": dropped,
+    }
@@ -0,0 +1,195 @@
+import json
+import logging
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model.int8.onnx"
+ONNX_CONFIG_FILE = "embedding_config.json"
+
+
+class EmbeddingBackend:
+    """
+    Interfaz mínima de un backend de embeddings.
+    `encode` recibe textos y devuelve un np.ndarray (n_textos, dim).
+    """
+    name = "base"
+    # Identifica modelo + backend para caches persistentes de embeddings
+    cache_key = "base"
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        raise NotImplementedError
+
+
+class TorchEmbeddingBackend(EmbeddingBackend):
+    """Backend por defecto: SentenceTransformer en PyTorch (full precision)."""
+    name = "torch"
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.cache_key = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size)
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """
+    Backend ONNX Runtime para CPU, opcionalmente cuantizado a int8.
+    Reproduce el pooling del SentenceTransformer original (mean pooling y,
+    si el modelo lo tiene, normalización L2) para que los vectores sean
+    compatibles con las colecciones ya indexadas.
+    """
+    name = "onnx"
+
+    def __init__(self, model_dir: str, quantized: bool = True, num_threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_dir = Path(model_dir)
+        self.quantized = quantized
+
+        with open(self.model_dir / ONNX_CONFIG_FILE, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.cache_key = f"{self.config['model_name']}#onnx{'-int8' if quantized else ''}"
+
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(self.model_dir / model_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config.get("pad_token_id", 0))
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.config["dimension"]), dtype=np.float32)
+
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            # Mean pooling sobre tokens reales (igual que sentence-transformers)
+            mask = attention_mask[..., None].astype(np.float32)
+            summed = (token_embeddings * mask).sum(axis=1)
+            counts = np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled = summed / counts
+
+            if self.config.get("normalize"):
+                norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+                pooled = pooled / np.clip(norms, 1e-12, None)
+
+            batches.append(pooled.astype(np.float32))
+
+        return np.vstack(batches)
+
+
+def export_onnx_model(model_name: str, output_dir: str, quantize: bool = True) -> Path:
+    """
+    Exporta el transformer de un SentenceTransformer a ONNX (y opcionalmente
+    una variante int8 con cuantización dinámica). Solo requiere torch en el
+    momento de exportar; el backend ONNX no lo carga.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out = Path(output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    auto_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+
+    poolers = [m for m in st_model if type(m).__name__ == "Pooling"]
+    if poolers and not poolers[0].pooling_mode_mean_tokens:
+        raise ValueError(f"Only mean pooling models are supported for ONNX export: {model_name}")
+    normalize = any(type(m).__name__ == "Normalize" for m in st_model)
+
+    sample = tokenizer(["texto de ejemplo"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask"]
+    if "token_type_ids" in sample:
+        input_names.append("token_type_ids")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    logger.info(f"Exporting {model_name} to ONNX at {out}")
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            tuple(sample[name] for name in input_names),
+            str(out / ONNX_MODEL_FILE),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    tokenizer.save_pretrained(str(out))
+
+    config = {
+        "model_name": model_name,
+        "max_seq_length": st_model.max_seq_length,
+        "dimension": st_model.get_sentence_embedding_dimension(),
+        "normalize": normalize,
+        "pad_token_id": tokenizer.pad_token_id or 0,
+    }
+    with open(out / ONNX_CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info("Quantizing ONNX model to int8")
+        quantize_dynamic(
+            str(out / ONNX_MODEL_FILE),
+            str(out / ONNX_QUANTIZED_MODEL_FILE),
+            weight_type=QuantType.QInt8,
+        )
+
+    return out
+
+
+def load_embedding_backend(backend: Optional[str] = None) -> EmbeddingBackend:
+    """
+    Crea el backend configurado en EMBEDDING_BACKEND ("torch" u "onnx").
+    Si el modelo ONNX no existe todavía en EMBEDDING_ONNX_DIR, se exporta.
+    """
+    backend = (backend or settings.EMBEDDING_BACKEND).lower()
+
+    if backend == "onnx":
+        model_dir = Path(settings.EMBEDDING_ONNX_DIR)
+        quantized = settings.EMBEDDING_ONNX_QUANTIZE
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        if not (model_dir / model_file).exists() or not (model_dir / ONNX_CONFIG_FILE).exists():
+            logger.warning(f"ONNX embedding model not found at {model_dir}, exporting from {settings.EMBEDDING_MODEL}")
+            export_onnx_model(settings.EMBEDDING_MODEL, str(model_dir), quantize=quantized)
+        return OnnxEmbeddingBackend(str(model_dir), quantized=quantized, num_threads=settings.EMBEDDING_ONNX_THREADS)
+
+    if backend != "torch":
+        logger.warning(f"Unknown EMBEDDING_BACKEND '{backend}', falling back to torch")
+    return TorchEmbeddingBackend(settings.EMBEDDING_MODEL)
@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# SQLite limita la cantidad de parámetros por sentencia
+_SQL_BATCH = 500
+
+
+def content_key(model_key: str, text: str) -> str:
+    """Clave direccionada por contenido: sha256(modelo, texto)."""
+    h = hashlib.sha256()
+    h.update(model_key.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Cache persistente de embeddings en SQLite, indexado por hash(modelo, texto).
+    Permite re-indexar sin volver a codificar chunks cuyo texto no cambió.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), _SQL_BATCH):
+                batch = unique[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embedding WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        rows = [(key, len(vec), array("f", vec).tobytes()) for key, vec in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding (key, dim, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def embed(self, model_key: str, texts: List[str], encode_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        Devuelve embeddings para `texts`, codificando con `encode_fn` solo los
+        textos que no están en el store, y persistiendo los nuevos.
+        """
+        keys = [content_key(model_key, t) for t in texts]
+        cached = self.get_many(keys)
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = encode_fn(list(missing.values()))
+            fresh = dict(zip(missing.keys(), [[float(x) for x in v] for v in vectors]))
+            self.put_many(fresh)
+            cached.update(fresh)
+
+        logger.info(f"Embedding store: {len(texts) - len(missing)} reused, {len(missing)} encoded")
+        return [cached[k] for k in keys]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embedding").fetchone()[0]
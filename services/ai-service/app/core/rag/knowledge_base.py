@@ -1,14 +1,23 @@
+import hashlib
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
 from chromadb.config import Settings as ChromaSettings
-from sentence_transformers import SentenceTransformer
 from typing import List, Dict, Literal, Optional
 from app.config import settings
+from app.core.metrics import cache_requests, span
+from app.core.rag.bm25_index import BM25Index
+from app.core.rag.embedding_backends import load_embedding_backend
+from app.core.rag.embedding_cache import QueryEmbeddingCache
+from app.core.rag.embedding_store import EmbeddingStore
 
 logger = logging.getLogger(__name__)
 
 KBCollectionName = Literal["practica_forense", "libros", "jurisprudencia", "legislacion", "doctrina", "external_cache"]
 EXTERNAL_CACHE_COLLECTION = "external_cache"
+LOCAL_COLLECTIONS: List[KBCollectionName] = ["practica_forense", "libros", "jurisprudencia", "legislacion", "doctrina"]
 
 class KnowledgeBase:
     """
@@ -18,9 +27,34 @@ class KnowledgeBase:
         logger.info(f"Initializing KnowledgeBase at {settings.CHROMA_PERSIST_DIR}")
         self.client = chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIR)
         
-        logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL}")
+        logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL} (backend={settings.EMBEDDING_BACKEND})")
         # Initialize embedding model (lazy load might be better for startup speed, but eager is safer for readiness)
-        self.embedding_model = SentenceTransformer(settings.EMBEDDING_MODEL)
+        self.embedding_model = load_embedding_backend()
+
+        # Store persistente de embeddings de chunks (evita re-codificar al re-indexar)
+        self.embedding_store = EmbeddingStore(settings.EMBEDDING_STORE_PATH) if settings.EMBEDDING_STORE_ENABLED else None
+
+        # Índice léxico BM25 junto a la persistencia de Chroma (búsqueda híbrida)
+        self.lexical_index = (
+            BM25Index(os.path.join(settings.CHROMA_PERSIST_DIR, "bm25_index.db"))
+            if settings.HYBRID_SEARCH_ENABLED else None
+        )
+
+        # Cache LRU de embeddings de queries (las preguntas repetidas no se re-codifican)
+        self.query_cache = QueryEmbeddingCache(max_size=settings.QUERY_EMBEDDING_CACHE_SIZE)
+
+        # Versión del contenido: sube con cada escritura en este proceso; el
+        # fingerprint además considera los conteos (ingestas desde scripts)
+        self.version = 0
+        self._fingerprint: Optional[str] = None
+        self._fingerprint_at = 0.0
+        self._fingerprint_version = -1
+
+        # Pool acotado para consultar varias colecciones en paralelo (search_many)
+        self._query_executor = ThreadPoolExecutor(
+            max_workers=settings.KB_QUERY_MAX_WORKERS,
+            thread_name_prefix="kb-query",
+        )
 
     def get_collection(self, name: KBCollectionName):
         """Obtiene o crea una colección."""
@@ -34,13 +68,31 @@ class KnowledgeBase:
         embeddings = self.embedding_model.encode(texts)
         return embeddings.tolist()
 
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embeddings de chunks, reutilizando el store persistente si está habilitado."""
+        if self.embedding_store is None:
+            return self.embed_texts(texts)
+        return self.embedding_store.embed(self.embedding_model.cache_key, texts, self.embed_texts)
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embedding de una query, usando el cache LRU de queries."""
+        cached = self.query_cache.get(query)
+        if cached is not None:
+            cache_requests.inc(cache="query_embedding", result="hit")
+            return cached
+        cache_requests.inc(cache="query_embedding", result="miss")
+        with span("kb.embed_query"):
+            embedding = self.embed_texts([query])[0]
+        self.query_cache.put(query, embedding)
+        return embedding
+
     def add_documents(self, collection_name: KBCollectionName, ids: List[str], texts: List[str], metadatas: List[Dict]):
         """Añade documentos a una colección."""
         if not ids:
             return
             
         collection = self.get_collection(collection_name)
-        embeddings = self.embed_texts(texts)
+        embeddings = self.embed_documents(texts)
         
         collection.upsert(
             ids=ids,
@@ -48,21 +100,202 @@ class KnowledgeBase:
             embeddings=embeddings,
             metadatas=metadatas
         )
+        if collection_name != EXTERNAL_CACHE_COLLECTION:
+            self.version += 1
+            if self.lexical_index is not None:
+                self.lexical_index.upsert(collection_name, ids, texts)
         logger.info(f"Added/Upserted {len(ids)} documents to {collection_name}")
 
-    def search(self, collection_name: KBCollectionName, query: str, top_k: Optional[int] = None) -> List[Dict]:
+    def search(
+        self,
+        collection_name: KBCollectionName,
+        query: str,
+        top_k: Optional[int] = None,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+    ) -> List[Dict]:
         """
         Busca en una colección por similitud semántica.
+        `where` / `where_document` son filtros de Chroma que se aplican en el índice.
         """
         k = top_k or settings.TOP_K_RESULTS
+        query_embedding = self.embed_query(query)
+        return self._query_collection(collection_name, query_embedding, k, where, where_document)
+
+    def get_by_metadata(
+        self,
+        collection_name: KBCollectionName,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        Lookup exacto por ids y/o filtros de metadata, sin búsqueda vectorial.
+        Devuelve hits con el mismo formato que search (sin `score`).
+        """
         collection = self.get_collection(collection_name)
-        
-        query_embedding = self.embed_texts([query])[0]
-        
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k
+        results = collection.get(
+            ids=ids,
+            where=where,
+            where_document=where_document,
+            limit=limit,
+            include=["documents", "metadatas"],
         )
+        return [
+            {"id": doc_id, "document": doc, "metadata": meta}
+            for doc_id, doc, meta in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
+
+    def delete(self, collection_name: KBCollectionName, ids: Optional[List[str]] = None, where: Optional[Dict] = None) -> None:
+        """Elimina documentos por ids o por filtro de metadata."""
+        if not ids and not where:
+            return
+        collection = self.get_collection(collection_name)
+        lexical = self.lexical_index is not None and collection_name != EXTERNAL_CACHE_COLLECTION
+        if where is not None and lexical:
+            # El índice BM25 borra por id: se resuelven antes los ids que cumplen el filtro
+            ids = collection.get(ids=ids, where=where, include=[])["ids"]
+            if not ids:
+                return
+            collection.delete(ids=ids)
+        else:
+            collection.delete(ids=ids, where=where)
+        if collection_name != EXTERNAL_CACHE_COLLECTION:
+            self.version += 1
+            if lexical and ids:
+                self.lexical_index.delete(collection_name, ids)
+
+    def content_fingerprint(self, max_age_seconds: float = 30.0) -> str:
+        """
+        Huella del contenido de las colecciones locales (versión en proceso +
+        conteo por colección). Se recalcula a lo más cada `max_age_seconds`,
+        o de inmediato si este proceso escribió en la KB.
+        """
+        now = time.monotonic()
+        if (
+            self._fingerprint is not None
+            and self._fingerprint_version == self.version
+            and now - self._fingerprint_at < max_age_seconds
+        ):
+            return self._fingerprint
+        version = self.version
+        counts = [f"{name}={self.get_collection_count(name)}" for name in LOCAL_COLLECTIONS]
+        raw = f"{version}|{'|'.join(counts)}"
+        self._fingerprint = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+        self._fingerprint_at = now
+        self._fingerprint_version = version
+        return self._fingerprint
+
+    def search_many(self, collection_names: List[KBCollectionName], query: str, top_k: Optional[int] = None) -> List[Dict]:
+        """
+        Busca en varias colecciones codificando la query una sola vez.
+        Las consultas a Chroma se ejecutan en paralelo sobre un pool acotado.
+        Cada hit incluye `source_type` con el nombre de su colección; las
+        colecciones que fallan se registran y se omiten.
+        """
+        if not collection_names:
+            return []
+
+        k = top_k or settings.TOP_K_RESULTS
+        query_embedding = self.embed_query(query)
+
+        futures = {
+            name: self._query_executor.submit(self._query_collection, name, query_embedding, k)
+            for name in collection_names
+        }
+
+        merged = []
+        for name, future in futures.items():
+            try:
+                hits = future.result()
+            except Exception as e:
+                logger.warning(f"Error searching local collection {name}: {e}")
+                continue
+            for h in hits:
+                h["source_type"] = name
+                h["retrieval"] = "vector"
+                merged.append(h)
+
+        return merged
+
+    def lexical_search_many(self, collection_names: List[KBCollectionName], query: str, top_k: Optional[int] = None) -> List[Dict]:
+        """
+        Búsqueda léxica BM25 en varias colecciones. Devuelve hits con el mismo
+        formato que search_many (`score` es el puntaje BM25, no comparable con
+        la similitud vectorial; se combinan por rank en multi_source_search).
+        """
+        if self.lexical_index is None or not collection_names:
+            return []
+
+        k = top_k or settings.TOP_K_RESULTS
+        merged = []
+        for name in collection_names:
+            try:
+                with span("kb.lexical", collection=name):
+                    ranked = self.lexical_index.search(name, query, k)
+                    if not ranked:
+                        continue
+                    ids = [doc_id for doc_id, _ in ranked]
+                    got = self.get_collection(name).get(ids=ids, include=["documents", "metadatas"])
+                by_id = {
+                    doc_id: (doc, meta)
+                    for doc_id, doc, meta in zip(got["ids"], got["documents"], got["metadatas"])
+                }
+            except Exception as e:
+                logger.warning(f"Error in lexical search on collection {name}: {e}")
+                continue
+
+            for doc_id, bm25_score in ranked:
+                if doc_id not in by_id:
+                    continue
+                doc, meta = by_id[doc_id]
+                merged.append({
+                    "id": doc_id,
+                    "document": doc,
+                    "metadata": meta,
+                    "score": bm25_score,
+                    "source_type": name,
+                    "retrieval": "lexical",
+                })
+
+        return merged
+
+    def rebuild_lexical_index(self, collection_name: KBCollectionName, batch_size: int = 1000) -> int:
+        """Reconstruye el índice BM25 de una colección a partir de lo guardado en Chroma."""
+        if self.lexical_index is None:
+            return 0
+        collection = self.get_collection(collection_name)
+        total = 0
+        offset = 0
+        while True:
+            page = collection.get(limit=batch_size, offset=offset, include=["documents"])
+            if not page["ids"]:
+                break
+            self.lexical_index.upsert(collection_name, page["ids"], page["documents"])
+            total += len(page["ids"])
+            offset += batch_size
+        logger.info(f"Rebuilt BM25 index for {collection_name}: {total} documents")
+        return total
+
+    def _query_collection(
+        self,
+        collection_name: KBCollectionName,
+        query_embedding: List[float],
+        k: int,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+    ) -> List[Dict]:
+        """Consulta una colección con un embedding ya calculado."""
+        collection = self.get_collection(collection_name)
+
+        with span("kb.query", collection=collection_name):
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=k,
+                where=where,
+                where_document=where_document,
+            )
         
         # Normalize results
         # Chroma returns lists of lists (one per query). We only have 1 query.
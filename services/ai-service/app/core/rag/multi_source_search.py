@@ -1,144 +1,308 @@
 import asyncio
 import logging
 import time
+from collections import defaultdict
 from typing import List, Dict, Optional
 
-from app.core.rag.knowledge_base import knowledge_base
-from app.services.external_search_cache import ExternalSearchCache
+from app.config import settings
+from app.core.executors import cpu_executor, io_executor
+from app.core.metrics import source_requests, span, stage_duration
+from app.core.rag.knowledge_base import LOCAL_COLLECTIONS, knowledge_base
+from app.core.rag.single_flight import SingleFlight
+from app.core.rag.source_router import latency_model, route_sources
+from app.services.cache_sweeper import ExternalCacheSweeper
+from app.services.circuit_breaker import CircuitOpenError, get_breaker
+from app.services.external_search_cache import ExternalSearchCache, cache_key
 from app.services.scrapers import pjud_scraper_playwright_v2 as pjud
 from app.services.scrapers import bcn_scraper as bcn
 from app.services.scrapers import scielo_scraper as scielo
+from app.services.question_classifier import classify_area
 from app.services.telemetry import TelemetryLogger
 
 logger = logging.getLogger(__name__)
 
 # Initialize cache
 cache = ExternalSearchCache(knowledge_base)
+cache_sweeper = ExternalCacheSweeper(cache)
 
-async def search_local(query: str, top_k: int) -> List[Dict]:
-    """Search local ChromaDB collections."""
-    collections = ["practica_forense", "libros", "jurisprudencia", "legislacion", "doctrina"]
-    results = []
+class NegativeCacheHit(Exception):
+    """La búsqueda se omitió por una entrada vigente del cache negativo."""
+
+async def search_local(query: str, top_k: int, collections: Optional[List[str]] = None) -> List[Dict]:
+    """Search local ChromaDB collections (todas, o las elegidas por el router)."""
+    collections = collections or LOCAL_COLLECTIONS
     
     # Distribute top_k somewhat evenly or just query all and rank
     k_per_col = max(2, int(top_k / 2))
     
-    for col in collections:
-        try:
-            hits = knowledge_base.search(col, query, top_k=k_per_col)
-            for h in hits:
-                h["source_type"] = col
-                results.append(h)
-        except Exception as e:
-            logger.warning(f"Error searching local collection {col}: {e}")
-            
+    # Un solo encode + consultas paralelas, fuera del event loop.
+    # Con búsqueda híbrida, BM25 corre en paralelo a la búsqueda vectorial.
+    tasks = [cpu_executor.run(knowledge_base.search_many, collections, query, k_per_col)]
+    if settings.HYBRID_SEARCH_ENABLED:
+        tasks.append(cpu_executor.run(knowledge_base.lexical_search_many, collections, query, k_per_col))
+
+    results = []
+    for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(outcome, Exception):
+            logger.warning(f"Error searching local collections: {outcome}")
+            continue
+        results.extend(outcome)
     return results
 
+def _to_chunk(source_name: str, item: Dict, score: float) -> Dict:
+    """Normalize a raw scraper item to Chunk format."""
+    # Create a text representation for the 'document' field
+    # This depends on the source structure
+    doc_text = ""
+    if source_name == "pjud":
+        doc_text = f"SENTENCIA: {item.get('caratulado')} ROL: {item.get('rol')} FECHA: {item.get('fecha')} RESUMEN: {item.get('resumen')}"
+    elif source_name == "bcn":
+        doc_text = f"NORMA: {item.get('tipo')} {item.get('numero')} TITULO: {item.get('titulo')} URL: {item.get('url')}"
+    elif source_name == "scielo":
+        doc_text = f"ARTICULO: {item.get('titulo')} REVISTA: {item.get('revista')} AUTORES: {', '.join(item.get('autores') or [])}"
+
+    return {
+        "source_type": source_name,
+        "score": score,
+        "document": doc_text,
+        "metadata": item # Store full raw data in metadata
+    }
+
+async def _scrape(source_name: str, query: str, top_k: int) -> List[Dict]:
+    """Llama al scraper de la fuente y devuelve los items crudos."""
+    if source_name == "pjud":
+        return await pjud.search(query, max_results=top_k)
+    elif source_name == "bcn":
+        return await bcn.search_legislation(query, max_results=top_k)
+    elif source_name == "scielo":
+        return await scielo.search_scielo(query, max_results=top_k)
+    return []
+
+# Scrapes en curso por clave de cache: los pedidos concurrentes idénticos
+# (misma fuente, query normalizada y parámetros) comparten una sola tarea,
+# incluidos los refrescos en segundo plano de stale-while-revalidate.
+scraper_flight = SingleFlight("scrapers")
+
+async def _scrape_and_cache(source_name: str, query: str, top_k: int, params: Dict) -> List[Dict]:
+    breaker = get_breaker(source_name)
+    start = time.perf_counter()
+    try:
+        scraped_data = await _scrape(source_name, query, top_k)
+    except Exception as e:
+        breaker.record(False, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+        # Cache negativo por clase de error: los reintentos inmediatos no vuelven a pagar el timeout
+        await io_executor.run(cache.set_negative, query, source_name, type(e).__name__, params)
+        raise
+    except asyncio.CancelledError:
+        breaker.record(False, time.perf_counter() - start, error="cancelled")
+        raise
+    breaker.record(True, time.perf_counter() - start)
+    if scraped_data:
+        await io_executor.run(cache.set, query, source_name, scraped_data, params)
+    else:
+        await io_executor.run(cache.set_negative, query, source_name, "empty", params)
+    return scraped_data
+
+async def _schedule_refresh(source_name: str, query: str, top_k: int, params: Dict) -> None:
+    """Agenda un refresco en segundo plano, salvo que ya haya un scrape en curso para la misma clave."""
+    key = cache_key(query, source_name, params)
+    if scraper_flight.in_flight(key):
+        return
+    if await io_executor.run(cache.is_negative, query, source_name, params):
+        return
+    # Otro request pudo iniciar el refresco mientras se consultaba el cache negativo
+    if scraper_flight.in_flight(key) or not get_breaker(source_name).allow_request():
+        return
+    task = scraper_flight.start(key, lambda: _scrape_and_cache(source_name, query, top_k, params))
+
+    def _log_refresh_error(t: asyncio.Task) -> None:
+        if not t.cancelled() and t.exception() is not None:
+            logger.error(f"Error refreshing {source_name} in background: {t.exception()}")
+
+    task.add_done_callback(_log_refresh_error)
+
 async def search_external_source(source_name: str, query: str, top_k: int) -> List[Dict]:
     """Search a single external source with caching."""
-    results = []
+    params = {"max_results": top_k}
     
-    # 1. Check Cache
-    cached_hits = cache.get(query, source_name)
-    if cached_hits:
-        logger.info(f"Cache hit for {source_name}: {len(cached_hits)} results")
-        # Normalize cached hits
-        for h in cached_hits:
-            # Ensure source_type is set
-            h["source_type"] = source_name
-            # Ensure score (cache might have it, or we assign default)
-            if "score" not in h:
-                h["score"] = 0.85 # High confidence for cache? Or just base.
-            results.append(h)
-        return results[:top_k]
+    # 1. Check Cache (exact key first, optional semantic fallback)
+    cached_items, stale = await io_executor.run(cache.lookup, query, source_name, params)
+    if cached_items:
+        logger.info(f"Cache hit for {source_name}: {len(cached_items)} results (stale={stale})")
+        chunks = [_to_chunk(source_name, item, 0.85) for item in cached_items[:top_k]]
+        if stale:
+            # Stale-while-revalidate: se sirve lo cacheado y se refresca fuera del request
+            for c in chunks:
+                c["metadata"]["stale"] = True
+            await _schedule_refresh(source_name, query, top_k, params)
+        return chunks
         
-    # 2. Scrape if no cache
+    # 1b. Negative cache: búsquedas recientes vacías o fallidas no se reintentan
+    negative = await io_executor.run(cache.get_negative, query, source_name, params)
+    if negative:
+        logger.info(f"Negative cache hit for {source_name}: {negative}")
+        raise NegativeCacheHit(negative)
+
+    # 1c. Circuit breaker: si la fuente está caída se omite al instante
+    # (quien se sume a un scrape ya en curso no consume un intento de prueba)
+    key = cache_key(query, source_name, params)
+    if not scraper_flight.in_flight(key) and not get_breaker(source_name).allow_request():
+        raise CircuitOpenError(f"Circuit open for {source_name}")
+
+    # 2. Scrape if no cache (single-flight) and 3. Cache results
     try:
-        scraped_data = []
-        if source_name == "pjud":
-            scraped_data = await pjud.search(query, max_results=top_k)
-        elif source_name == "bcn":
-            scraped_data = await bcn.search_legislation(query, max_results=top_k)
-        elif source_name == "scielo":
-            scraped_data = await scielo.search_scielo(query, max_results=top_k)
-            
-        # 3. Cache results
-        if scraped_data:
-            cache.set(query, source_name, scraped_data)
-            
-        # 4. Normalize to Chunk format
-        for item in scraped_data:
-            # Create a text representation for the 'document' field
-            # This depends on the source structure
-            doc_text = ""
-            if source_name == "pjud":
-                doc_text = f"SENTENCIA: {item.get('caratulado')} ROL: {item.get('rol')} FECHA: {item.get('fecha')} RESUMEN: {item.get('resumen')}"
-            elif source_name == "bcn":
-                doc_text = f"NORMA: {item.get('tipo')} {item.get('numero')} TITULO: {item.get('titulo')} URL: {item.get('url')}"
-            elif source_name == "scielo":
-                doc_text = f"ARTICULO: {item.get('titulo')} REVISTA: {item.get('revista')} AUTORES: {', '.join(item.get('autores', []))}"
-                
-            results.append({
-                "source_type": source_name,
-                "score": 0.8, # Base score for fresh external data
-                "document": doc_text,
-                "metadata": item # Store full raw data in metadata
-            })
-            
+        scraped_data = await scraper_flight.do(
+            key, lambda: _scrape_and_cache(source_name, query, top_k, params)
+        )
     except Exception as e:
+        # Se propaga para que _run_with_deadline lo registre como "error"
         logger.error(f"Error scraping {source_name}: {e}")
-        
+        raise
+
+    # 4. Normalize to Chunk format
+    results = [_to_chunk(source_name, item, 0.8) for item in scraped_data] # Base score for fresh external data
     return results[:top_k]
 
+def _reciprocal_rank_fusion(results: List[Dict], k: int) -> List[Dict]:
+    """
+    Reciprocal-rank fusion: cada (fuente, tipo de recuperación) es una lista
+    rankeada por su propio score; un hit suma 1 / (k + rank) por cada lista
+    en que aparece. Los hits locales repetidos (vector + BM25) se fusionan.
+    """
+    ranked_lists = defaultdict(list)
+    for r in results:
+        ranked_lists[(r.get("source_type", "unknown"), r.get("retrieval", "external"))].append(r)
+
+    fused: Dict[tuple, Dict] = {}
+    for hits in ranked_lists.values():
+        hits.sort(key=lambda x: x.get("score", 0.0), reverse=True)
+        for rank, hit in enumerate(hits, start=1):
+            key = (hit.get("source_type"), hit["id"]) if hit.get("id") else ("_", id(hit))
+            entry = fused.get(key)
+            if entry is None:
+                entry = hit
+                entry["rrf_score"] = 0.0
+                fused[key] = entry
+            elif entry.get("retrieval") == "lexical" and hit.get("retrieval") == "vector":
+                # Conservamos el score vectorial (similitud) como score base
+                hit["rrf_score"] = entry["rrf_score"]
+                entry = fused[key] = hit
+            entry["rrf_score"] += 1.0 / (k + rank)
+
+    return list(fused.values())
+
 def _compute_score(item: Dict, weights: Dict[str, float]) -> float:
     """Compute adjusted score based on base score and learned weights."""
-    base_score = item.get("score", 0.5)
+    base_score = item.get("rrf_score", item.get("score", 0.5))
     source = item.get("source_type", "unknown")
     weight = weights.get(source, 1.0)
     return base_score * weight
 
-async def multi_source_search(
+async def _run_with_deadline(source_name: str, coro, timeout: float) -> tuple:
+    """
+    Ejecuta la búsqueda de una fuente con deadline. Si vence, la espera se
+    cancela; los scrapers siguen en su tarea single-flight y terminan en cache.
+    """
+    start = time.perf_counter()
+    try:
+        hits = await asyncio.wait_for(coro, timeout=timeout)
+        status = "ok"
+    except asyncio.TimeoutError:
+        logger.warning(f"Source {source_name} missed its deadline ({timeout:.1f}s)")
+        hits, status = [], "timeout"
+    except CircuitOpenError:
+        logger.info(f"Skipping {source_name}: circuit open")
+        hits, status = [], "circuit_open"
+    except NegativeCacheHit:
+        hits, status = [], "cached_miss"
+    except Exception as e:
+        logger.error(f"Error searching {source_name}: {e}")
+        hits, status = [], "error"
+    elapsed_ms = int((time.perf_counter() - start) * 1000)
+    return source_name, hits, status, elapsed_ms
+
+async def multi_source_search_detailed(
     query: str,
     top_k: int = 5,
     use_external: bool = True,
     rag_query_id: Optional[int] = None,
-) -> List[Dict]:
+    budget_seconds: Optional[float] = None,
+) -> Dict:
     """
     Orchestrate search across local and external sources.
+
+    Un router (source_router) elige primero qué colecciones y scrapers
+    consultar según el área de la pregunta, los pesos aprendidos y la
+    latencia esperada de cada fuente.
+
+    Cada fuente corre con su propio deadline (SOURCE_DEADLINES_SECONDS), acotado
+    por el presupuesto total del request (SEARCH_BUDGET_SECONDS). Se rankea lo
+    que alcanzó a terminar y se informa qué fuentes vencieron o se omitieron
+    por circuito abierto:
+    {"results": [...], "timed_out_sources": [...], "skipped_sources": [...],
+     "source_status": {...}, "routing": {...}}
     """
+    budget = budget_seconds or settings.SEARCH_BUDGET_SECONDS
+    deadlines = settings.SOURCE_DEADLINES_SECONDS
+
+    def deadline_for(source_name: str) -> float:
+        return min(deadlines.get(source_name, budget), budget)
+
+    # 0. Routing (los pesos se reutilizan después para el ranking)
+    telemetry = TelemetryLogger.instance()
+    with span("search.routing"):
+        area = None
+        if rag_query_id:
+            area = telemetry.get_area_for_query(rag_query_id)
+        area = area or classify_area(query)
+        # Cache en proceso: solo lee el dict (un hilo lo recarga por TTL o cuando sube la versión)
+        source_weights = telemetry.get_source_weights(default=1.0, area=area)
+        routing = route_sources(query, source_weights, budget, area=area)
+    external_sources = routing["external"] if use_external else []
+    logger.info(
+        f"Routing area={routing['area']} collections={routing['collections']} "
+        f"external={external_sources} skipped={routing['skipped']}"
+    )
+
     tasks = []
     
     # 1. Local Search
-    tasks.append(search_local(query, top_k))
+    tasks.append(_run_with_deadline("local", search_local(query, top_k, routing["collections"]), deadline_for("local")))
     
     # 2. External Search
-    if use_external:
-        tasks.append(search_external_source("pjud", query, top_k))
-        tasks.append(search_external_source("bcn", query, top_k))
-        tasks.append(search_external_source("scielo", query, top_k))
+    for source_name in external_sources:
+        tasks.append(_run_with_deadline(
+            source_name, search_external_source(source_name, query, top_k), deadline_for(source_name)
+        ))
         
     # Execute all
-    results_lists = await asyncio.gather(*tasks)
+    outcomes = await asyncio.gather(*tasks)
     
     # Flatten results
     all_results = []
-    for lst in results_lists:
-        all_results.extend(lst)
-        
-    # 3. Apply Telemetry Weights
-    telemetry = TelemetryLogger.instance()
-    area = None
-    if rag_query_id:
-        area = telemetry.get_area_for_query(rag_query_id)
-    
-    source_weights = telemetry.get_source_weights(default=1.0, area=area)
-    
-    # Calculate adjusted scores
-    for r in all_results:
-        r["adjusted_score"] = _compute_score(r, source_weights)
-        
-    # 4. Rank
-    all_results.sort(key=lambda x: x["adjusted_score"], reverse=True)
+    source_status = {}
+    for source_name, hits, status, elapsed_ms in outcomes:
+        all_results.extend(hits)
+        source_status[source_name] = {"status": status, "elapsed_ms": elapsed_ms, "hits": len(hits)}
+        source_requests.inc(source=source_name, status=status)
+        stage_duration.observe(elapsed_ms / 1000, stage="search.source", source=source_name)
+        if status in ("ok", "timeout"):
+            # Modelo de costo del router (un timeout cuenta como el deadline completo)
+            latency_model.observe(source_name, elapsed_ms)
+    timed_out = [name for name, st in source_status.items() if st["status"] == "timeout"]
+    skipped = [name for name, st in source_status.items() if st["status"] == "circuit_open"]
+
+    with span("search.rank"):
+        if settings.HYBRID_SEARCH_ENABLED:
+            all_results = _reciprocal_rank_fusion(all_results, settings.RRF_K)
+
+        # 3. Apply Telemetry Weights
+        # Calculate adjusted scores
+        for r in all_results:
+            r["adjusted_score"] = _compute_score(r, source_weights)
+
+        # 4. Rank
+        all_results.sort(key=lambda x: x["adjusted_score"], reverse=True)
     
     final_results = all_results[:top_k]
     
@@ -147,4 +311,23 @@ async def multi_source_search(
         sources_used = list(set(r["source_type"] for r in final_results))
         telemetry.log_sources_for_query(rag_query_id, sources_used)
         
-    return final_results
+    return {
+        "results": final_results,
+        "timed_out_sources": timed_out,
+        "skipped_sources": skipped,
+        "source_status": source_status,
+        "routing": routing,
+    }
+
+async def multi_source_search(
+    query: str,
+    top_k: int = 5,
+    use_external: bool = True,
+    rag_query_id: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Orchestrate search across local and external sources.
+    Devuelve solo la lista rankeada (ver multi_source_search_detailed).
+    """
+    detailed = await multi_source_search_detailed(query, top_k, use_external, rag_query_id)
+    return detailed["results"]
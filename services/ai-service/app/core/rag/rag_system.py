@@ -1,13 +1,29 @@
 import logging
+import time
 import uuid
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple
 from app.core.ai.gemini_client import gemini_client
-from app.core.rag.multi_source_search import multi_source_search
+from app.core.executors import cpu_executor, io_executor
+from app.core.metrics import cache_requests, span, stage_duration
+from app.core.rag.context_packer import pack_context
+from app.core.rag.knowledge_base import knowledge_base
+from app.core.rag.multi_source_search import multi_source_search_detailed
+from app.services.answer_cache import AnswerCache
 from app.services.telemetry import TelemetryLogger
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+ERROR_ANSWER = "Lo siento, ocurrió un error al generar la respuesta."
+
+answer_cache = AnswerCache() if settings.ANSWER_CACHE_ENABLED else None
+
+def _cache_lookup(question: str) -> Tuple[List[float], str, Optional[Dict[str, Any]]]:
+    """Embedding de la pregunta (LRU de queries, se reutiliza en la búsqueda) + lookup."""
+    embedding = knowledge_base.embed_query(question)
+    kb_fingerprint = knowledge_base.content_fingerprint(settings.ANSWER_CACHE_KB_CHECK_SECONDS)
+    return embedding, kb_fingerprint, answer_cache.lookup(embedding, kb_fingerprint)
+
 class RAGSystem:
     """
     Orquestador principal del sistema RAG.
@@ -16,33 +32,27 @@ class RAGSystem:
     def __init__(self):
         self.telemetry = TelemetryLogger.instance()
 
-    async def answer(self, question: str) -> Dict[str, Any]:
-        correlation_id = str(uuid.uuid4())
-        logger.info(f"RAG Answer Start: {correlation_id} - Q: {question}")
-        
+    async def _retrieve(self, question: str) -> Dict[str, Any]:
+        """Búsqueda multi-fuente + construcción del system prompt."""
         # 1. Búsqueda Multi-Fuente
         # Nota: multi_source_search ahora es async
-        results = await multi_source_search(question, rag_query_id=None) # Pasamos None por ahora, o adaptamos multi_source_search para usar correlation_id string
-        
+        with span("search"):
+            search = await multi_source_search_detailed(question, rag_query_id=None) # Pasamos None por ahora, o adaptamos multi_source_search para usar correlation_id string
+        results = search["results"]
+
         # Filtrar y ordenar top-k
         # multi_source_search ya devuelve ordenado por adjusted_score
         top_results = results[:settings.TOP_K_RESULTS]
-        
-        # 2. Construcción de Contexto
-        context_parts = []
-        for r in top_results:
-            source = r.get("source_type", "unknown")
-            score = r.get("adjusted_score", 0.0)
-            content = r.get("document", "")[:500] # Truncar para no exceder ventana
-            meta = r.get("metadata", {})
-            
-            # Formatear metadata relevante
-            meta_str = ", ".join([f"{k}:{v}" for k, v in meta.items() if v and k not in ["document", "source_type"]])
-            
-            context_parts.append(f"FUENTE: {source} (score={score:.2f})\nMETADATA: {meta_str}\nCONTENIDO: {content}")
-            
-        context_text = "\n\n".join(context_parts)
-        
+
+        # 2. Construcción de Contexto (presupuesto de tokens por modelo, sin duplicados)
+        with span("context_pack"):
+            packed = pack_context(top_results, model_name=settings.MODEL_NAME)
+        context_text = packed["text"]
+        logger.info(
+            f"Context packed: {packed['tokens_used']}/{packed['token_budget']} tokens, "
+            f"{len(packed['sources'])}/{len(top_results)} chunks, dropped={packed['dropped']}"
+        )
+
         # 3. Prompt Engineering
         system_prompt = (
             "Eres J.A.R.V.I.S., un asistente legal experto en derecho chileno.\n"
@@ -54,26 +64,204 @@ class RAGSystem:
             "4. Usa formato Markdown para estructurar tu respuesta.\n"
             f"\nCONTEXTO DISPONIBLE:\n{context_text}"
         )
-        
+
+        return {
+            "sources": packed["sources"],
+            "system_prompt": system_prompt,
+            "timed_out_sources": search["timed_out_sources"],
+            "context_tokens": packed["tokens_used"],
+            "routing": search.get("routing"),
+        }
+
+    def _log_answer(
+        self,
+        correlation_id: str,
+        question: str,
+        sources: List[Dict],
+        answer_text: str,
+        routing: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        if settings.TELEMETRY_ENABLED:
+            # Solo encola: el hilo escritor de TelemetryLogger persiste en lote
+            with span("telemetry"):
+                if routing:
+                    self.telemetry.log_routing(correlation_id, routing)
+                self.telemetry.log_rag_answer(correlation_id, question, sources, answer_text)
+
+    async def _check_cache(self, question: str, correlation_id: str) -> Tuple[Optional[Tuple[List[float], str]], Optional[Dict[str, Any]]]:
+        """Devuelve (clave para guardar la respuesta, hit del cache)."""
+        if answer_cache is None:
+            return None, None
+        try:
+            with span("answer_cache_lookup"):
+                embedding, kb_fingerprint, hit = await cpu_executor.run(_cache_lookup, question)
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: {e}")
+            cache_requests.inc(cache="answer", result="error")
+            return None, None
+        cache_requests.inc(cache="answer", result="miss" if hit is None else "hit")
+        if hit is not None:
+            logger.info(f"Answer cache hit: {correlation_id} (sim={hit['similarity']:.3f}, cached Q: {hit['question']})")
+            await io_executor.run(answer_cache.record_served, correlation_id, hit["entry_id"])
+        return (embedding, kb_fingerprint), hit
+
+    async def _store_in_cache(self, key, question: str, answer_text: str, retrieval: Dict[str, Any], correlation_id: str) -> None:
+        # Solo respuestas completas: sin error de generación ni fuentes que no alcanzaron a responder
+        if key is None or not retrieval["sources"] or retrieval["timed_out_sources"]:
+            return
+        embedding, kb_fingerprint = key
+        try:
+            await io_executor.run(
+                answer_cache.store, question, embedding, answer_text, retrieval["sources"], kb_fingerprint, correlation_id
+            )
+        except Exception as e:
+            logger.warning(f"Answer cache store failed: {e}")
+
+    async def answer(self, question: str) -> Dict[str, Any]:
+        correlation_id = str(uuid.uuid4())
+        logger.info(f"RAG Answer Start: {correlation_id} - Q: {question}")
+        started = time.perf_counter()
+
+        # 0. Cache semántico de respuestas (paráfrasis de preguntas ya respondidas)
+        cache_key, hit = await self._check_cache(question, correlation_id)
+        if hit is not None:
+            self._log_answer(correlation_id, question, hit["sources"], hit["answer"])
+            stage_duration.observe(time.perf_counter() - started, stage="total", cache="hit")
+            return {
+                "answer": hit["answer"],
+                "sources": hit["sources"],
+                "correlation_id": correlation_id,
+                "timed_out_sources": [],
+                "context_tokens": 0,
+                "cache_hit": True,
+            }
+
+        retrieval = await self._retrieve(question)
+        top_results = retrieval["sources"]
+
         # 4. Generación
         try:
-            answer_text = gemini_client.generate(system_prompt, question)
+            with span("generation"):
+                answer_text = await gemini_client.generate(retrieval["system_prompt"], question)
         except Exception as e:
             logger.error(f"Error generating answer: {e}")
-            answer_text = "Lo siento, ocurrió un error al generar la respuesta."
+            answer_text = ERROR_ANSWER
+            cache_key = None
 
         # 5. Telemetría
-        if settings.TELEMETRY_ENABLED:
-            # Adaptar log_rag_answer para aceptar correlation_id string
-            # El TelemetryLogger actual usa int ID para queries. 
-            # Vamos a necesitar ajustar TelemetryLogger para manejar correlation_id string o mapearlo.
-            # Por simplicidad en este paso, asumimos que log_rag_answer maneja la persistencia.
-            self.telemetry.log_rag_answer(correlation_id, question, top_results, answer_text)
+        self._log_answer(correlation_id, question, top_results, answer_text, retrieval["routing"])
+        await self._store_in_cache(cache_key, question, answer_text, retrieval, correlation_id)
+        stage_duration.observe(time.perf_counter() - started, stage="total", cache="miss")
 
         return {
             "answer": answer_text,
             "sources": top_results,
-            "correlation_id": correlation_id
+            "correlation_id": correlation_id,
+            "timed_out_sources": retrieval["timed_out_sources"],
+            "context_tokens": retrieval["context_tokens"],
+            "cache_hit": False,
         }
 
+    async def answer_stream(self, question: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Igual que `answer`, pero entrega eventos por etapa para SSE:
+        "sources" (apenas termina la búsqueda), "token" (fragmentos de Gemini)
+        y "done" (correlation_id y tiempos de cada etapa).
+        """
+        correlation_id = str(uuid.uuid4())
+        logger.info(f"RAG Stream Start: {correlation_id} - Q: {question}")
+        started = time.perf_counter()
+        # Si el cliente corta el stream (GeneratorExit/CancelledError) igual se
+        # registra lo que alcanzó a pasar; el finally no puede hacer await.
+        logged = False
+        top_results: List[Dict] = []
+        routing = None
+        parts: List[str] = []
+        try:
+            cache_key, hit = await self._check_cache(question, correlation_id)
+            if hit is not None:
+                self._log_answer(correlation_id, question, hit["sources"], hit["answer"])
+                logged = True
+                yield {
+                    "event": "sources",
+                    "data": {"correlation_id": correlation_id, "sources": hit["sources"], "timed_out_sources": []},
+                }
+                yield {"event": "token", "data": {"text": hit["answer"]}}
+                stage_duration.observe(time.perf_counter() - started, stage="total", cache="hit")
+                yield {
+                    "event": "done",
+                    "data": {
+                        "correlation_id": correlation_id,
+                        "error": None,
+                        "cache_hit": True,
+                        "telemetry": {"total_ms": int((time.perf_counter() - started) * 1000)},
+                    },
+                }
+                return
+
+            retrieval = await self._retrieve(question)
+            top_results = retrieval["sources"]
+            routing = retrieval["routing"]
+            retrieval_ms = int((time.perf_counter() - started) * 1000)
+
+            yield {
+                "event": "sources",
+                "data": {
+                    "correlation_id": correlation_id,
+                    "sources": top_results,
+                    "timed_out_sources": retrieval["timed_out_sources"],
+                },
+            }
+
+            first_token_ms = None
+            error = None
+            generation_started = time.perf_counter()
+            try:
+                async for text in gemini_client.generate_stream(retrieval["system_prompt"], question):
+                    if first_token_ms is None:
+                        first_token_ms = int((time.perf_counter() - started) * 1000)
+                        stage_duration.observe(time.perf_counter() - generation_started, stage="generation_first_token")
+                    parts.append(text)
+                    yield {"event": "token", "data": {"text": text}}
+            except Exception as e:
+                logger.error(f"Error streaming answer: {e}")
+                error = str(e)
+                if not parts:
+                    parts.append(ERROR_ANSWER)
+                    yield {"event": "token", "data": {"text": ERROR_ANSWER}}
+
+            stage_duration.observe(time.perf_counter() - generation_started, stage="generation")
+            answer_text = "".join(parts)
+            self._log_answer(correlation_id, question, top_results, answer_text, routing)
+            logged = True
+            if error is None:
+                await self._store_in_cache(cache_key, question, answer_text, retrieval, correlation_id)
+            stage_duration.observe(time.perf_counter() - started, stage="total", cache="miss")
+
+            yield {
+                "event": "done",
+                "data": {
+                    "correlation_id": correlation_id,
+                    "error": error,
+                    "cache_hit": False,
+                    "telemetry": {
+                        "retrieval_ms": retrieval_ms,
+                        "context_tokens": retrieval["context_tokens"],
+                        "routing": routing,
+                        "first_token_ms": first_token_ms,
+                        "total_ms": int((time.perf_counter() - started) * 1000),
+                        "answer_chars": len(answer_text),
+                    },
+                },
+            }
+        finally:
+            if not logged:
+                # aborted: respuesta parcial, sin guardar en el answer cache
+                logger.info(f"RAG Stream Aborted: {correlation_id} - {len(parts)} fragmentos enviados")
+                try:
+                    self._log_answer(correlation_id, question, top_results, "".join(parts), routing)
+                except Exception as e:
+                    logger.error(f"Error logging aborted stream {correlation_id}: {e}")
+                stage_duration.observe(time.perf_counter() - started, stage="total_aborted")
+
 rag_system = RAGSystem()
@@ -0,0 +1,48 @@
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    Coalescing de llamadas async concurrentes con la misma clave: la primera
+    crea la tarea y las siguientes esperan esa misma tarea. Cada caller recibe
+    una copia del resultado (los callers pueden mutarlo sin afectarse).
+
+    La tarea compartida corre protegida con `asyncio.shield`, así cancelar a un
+    caller (p.ej. por deadline) no cancela el trabajo para los demás.
+    """
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Devuelve la tarea en curso para `key`, o la crea."""
+        task = self._tasks.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        self.leaders += 1
+        task = asyncio.create_task(fn())
+        self._tasks[key] = task
+        task.add_done_callback(lambda _t: self._tasks.pop(key, None))
+        return task
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.start(key, fn)
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,129 @@
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.core.rag.knowledge_base import LOCAL_COLLECTIONS
+from app.services.question_classifier import classify_area
+
+logger = logging.getLogger(__name__)
+
+EXTERNAL_SOURCES = ["pjud", "bcn", "scielo"]
+
+# Relevancia a priori (0..1) de cada colección / scraper según el área de la pregunta.
+# Los pesos aprendidos (source_weight) la escalan; "otros" no tiene entrada: sin
+# área clara se consultan todas las fuentes.
+AREA_SOURCE_RELEVANCE: Dict[str, Dict[str, float]] = {
+    "procesal": {
+        "practica_forense": 1.0, "jurisprudencia": 0.9, "libros": 0.8, "legislacion": 0.7, "doctrina": 0.4,
+        "pjud": 0.8, "bcn": 0.5, "scielo": 0.1,
+    },
+    "civil": {
+        "libros": 1.0, "jurisprudencia": 0.9, "doctrina": 0.8, "legislacion": 0.7, "practica_forense": 0.5,
+        "pjud": 0.7, "bcn": 0.6, "scielo": 0.4,
+    },
+    "constitucional": {
+        "jurisprudencia": 1.0, "doctrina": 0.9, "legislacion": 0.8, "libros": 0.7, "practica_forense": 0.5,
+        "pjud": 0.8, "bcn": 0.8, "scielo": 0.6,
+    },
+    "penal": {
+        "jurisprudencia": 1.0, "libros": 0.8, "legislacion": 0.8, "practica_forense": 0.7, "doctrina": 0.6,
+        "pjud": 0.9, "bcn": 0.6, "scielo": 0.3,
+    },
+    "laboral": {
+        "legislacion": 1.0, "jurisprudencia": 0.9, "practica_forense": 0.8, "libros": 0.6, "doctrina": 0.4,
+        "pjud": 0.7, "bcn": 0.8, "scielo": 0.2,
+    },
+}
+
+# Latencia esperada inicial (ms) antes de tener observaciones
+DEFAULT_LATENCY_MS: Dict[str, float] = {"local": 300.0, "pjud": 4000.0, "bcn": 1500.0, "scielo": 2000.0}
+
+
+class SourceLatencyModel:
+    """Latencia esperada por fuente: media móvil exponencial de lo observado."""
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._ewma: Dict[str, float] = dict(DEFAULT_LATENCY_MS)
+        self._samples: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, source_name: str, elapsed_ms: float) -> None:
+        with self._lock:
+            prev = self._ewma.get(source_name)
+            self._ewma[source_name] = elapsed_ms if prev is None else prev + self.alpha * (elapsed_ms - prev)
+            self._samples[source_name] = self._samples.get(source_name, 0) + 1
+
+    def expected_ms(self, source_name: str) -> float:
+        with self._lock:
+            return self._ewma.get(source_name, DEFAULT_LATENCY_MS["local"])
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {"expected_ms": round(ms, 1), "samples": self._samples.get(name, 0)}
+                for name, ms in self._ewma.items()
+            }
+
+
+latency_model = SourceLatencyModel()
+
+
+def route_sources(
+    question: str,
+    source_weights: Dict[str, float],
+    budget_seconds: float,
+    area: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Decide qué colecciones locales y qué scrapers consultar para una pregunta.
+
+    utilidad = relevancia(área, fuente) * peso aprendido
+               - penalización * (latencia esperada / presupuesto)
+
+    Se consulta lo que supera SOURCE_ROUTING_MIN_UTILITY; de las colecciones
+    locales se mantienen al menos SOURCE_ROUTING_MIN_LOCAL.
+
+    Returns:
+        {"area", "collections", "external", "skipped", "utilities"}
+    """
+    area = area or classify_area(question)
+    relevance = AREA_SOURCE_RELEVANCE.get(area)
+    if not settings.SOURCE_ROUTING_ENABLED or relevance is None:
+        return {
+            "area": area,
+            "collections": list(LOCAL_COLLECTIONS),
+            "external": list(EXTERNAL_SOURCES),
+            "skipped": [],
+            "utilities": {},
+        }
+
+    penalty = settings.SOURCE_ROUTING_LATENCY_PENALTY
+    min_utility = settings.SOURCE_ROUTING_MIN_UTILITY
+    budget_ms = max(budget_seconds, 0.1) * 1000
+
+    def utility(source_name: str, cost_key: str) -> float:
+        value = relevance.get(source_name, 0.5) * source_weights.get(source_name, 1.0)
+        return value - penalty * min(1.0, latency_model.expected_ms(cost_key) / budget_ms)
+
+    # Las colecciones locales comparten un solo encode: el costo es el de "local"
+    utilities = {name: utility(name, "local") for name in LOCAL_COLLECTIONS}
+    utilities.update({name: utility(name, name) for name in EXTERNAL_SOURCES})
+
+    ranked_local = sorted(LOCAL_COLLECTIONS, key=lambda n: utilities[n], reverse=True)
+    collections = [n for n in ranked_local if utilities[n] >= min_utility]
+    for name in ranked_local:
+        if len(collections) >= settings.SOURCE_ROUTING_MIN_LOCAL:
+            break
+        if name not in collections:
+            collections.append(name)
+    external = [n for n in EXTERNAL_SOURCES if utilities[n] >= min_utility]
+    skipped = [n for n in list(LOCAL_COLLECTIONS) + EXTERNAL_SOURCES if n not in collections and n not in external]
+
+    return {
+        "area": area,
+        "collections": collections,
+        "external": external,
+        "skipped": skipped,
+        "utilities": {k: round(v, 3) for k, v in utilities.items()},
+    }
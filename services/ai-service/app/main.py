@@ -5,6 +5,7 @@ import asyncio
 import json
 from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional, Tuple
@@ -12,10 +13,16 @@ from typing import List, Dict, Any, Optional, Tuple
 from openai import OpenAI
 
 from app.config import settings
-from app.core.rag.rag_system import rag_system
+from app.core.ai.gemini_client import gemini_client
+from app.core.ai.llm_cache import llm_cache, llm_cache_key
+from app.core.executors import cpu_executor, executor_stats, io_executor
+from app.core.rag.rag_system import answer_cache, rag_system
+from app.core.rag.multi_source_search import cache_sweeper
+from app.routes import metrics, telemetry_indexing, telemetry_scrapers
+from app.services.source_weight_learner import source_weight_learner
 from app.services.tts_service import tts_service
 from app.services.telemetry import telemetry_logger as jarvis_telemetry
-from app.telemetry import compute_cost_usd, log_ai_usage
+from app.telemetry import ai_usage_shipper, compute_cost_usd, log_ai_usage
 
 # Configuración de Logging
 logging.basicConfig(level=settings.LOG_LEVEL)
@@ -35,6 +42,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Routers
+app.include_router(telemetry_indexing.router)
+app.include_router(telemetry_scrapers.router)
+app.include_router(metrics.router)
+
 # Static Files (Audio)
 os.makedirs("audio_cache", exist_ok=True)
 app.mount("/audio", StaticFiles(directory="audio_cache"), name="audio")
@@ -48,6 +60,9 @@ class AskResponse(BaseModel):
     sources: List[Dict[str, Any]]
     correlation_id: str
     audio_url: Optional[str] = None
+    timed_out_sources: List[str] = []
+    context_tokens: int = 0
+    cache_hit: bool = False
 
 class TTSRequest(BaseModel):
     text: str
@@ -74,22 +89,35 @@ def analyze_text_with_llm(text: str, required_placeholders: List[str]) -> Tuple[
         return {}, {}
 
     system_prompt = f"Analiza el siguiente documento legal y extrae: {', '.join(required_placeholders)}."
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"DOCUMENTO A ANALIZAR:\n\n{text[:15000]}"},
+    ]
+    response_format = {"type": "json_object"}
+    temperature = 0.1
 
     try:
+        # Re-subir el mismo escrito produce el mismo prompt: se responde desde el cache sin costo
+        cache_key = None
+        if llm_cache.is_cacheable(temperature):
+            cache_key = llm_cache_key("openai", "gpt-4o", messages, temperature, response_format)
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return cached, {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "latency_ms": 0, "cached": True}
+
         start = time.perf_counter()
         response = openai_client.chat.completions.create(
             model="gpt-4o",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"DOCUMENTO A ANALIZAR:\n\n{text[:15000]}"},
-            ],
-            temperature=0.1,
+            response_format=response_format,
+            messages=messages,
+            temperature=temperature,
         )
         elapsed_ms = int((time.perf_counter() - start) * 1000)
 
         result_json = response.choices[0].message.content
         data = json.loads(result_json)
+        if cache_key is not None:
+            llm_cache.set(cache_key, "openai", "gpt-4o", data)
 
         usage = {
             "prompt_tokens": getattr(response, "usage", None).prompt_tokens if getattr(response, "usage", None) else 0,
@@ -104,6 +132,27 @@ def analyze_text_with_llm(text: str, required_placeholders: List[str]) -> Tuple[
         logger.error(f"Error during LLM analysis: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error during AI analysis.")
 
+# --- Lifecycle ---
+
+@app.on_event("startup")
+async def start_background_tasks():
+    cache_sweeper.start()
+    # Reenvía lo que haya quedado en el spool de uso de IA
+    ai_usage_shipper.start()
+    if settings.TELEMETRY_ENABLED and settings.SOURCE_WEIGHT_LEARNER_ENABLED:
+        source_weight_learner.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await cache_sweeper.stop()
+    await source_weight_learner.stop()
+    await gemini_client.aclose()
+    # Escribe la telemetría pendiente antes de salir
+    await io_executor.run(jarvis_telemetry.close)
+    await ai_usage_shipper.stop(timeout=settings.AI_USAGE_DRAIN_TIMEOUT_SECONDS)
+    cpu_executor.shutdown()
+    io_executor.shutdown()
+
 # --- Endpoints ---
 
 @app.get("/health")
@@ -112,7 +161,10 @@ def health_check():
         "status": "ok",
         "version": "4.0",
         "tts_enabled": settings.TTS_ENABLED,
-        "telemetry_enabled": settings.TELEMETRY_ENABLED
+        "telemetry_enabled": settings.TELEMETRY_ENABLED,
+        "executors": executor_stats(),
+        "telemetry": {**jarvis_telemetry.stats(), "weight_learner": source_weight_learner.stats()},
+        "ai_usage": ai_usage_shipper.stats(),
     }
 
 @app.post("/ask", response_model=AskResponse)
@@ -122,12 +174,38 @@ async def ask_jarvis(req: AskRequest):
         return AskResponse(
             answer=result["answer"],
             sources=result["sources"],
-            correlation_id=result["correlation_id"]
+            correlation_id=result["correlation_id"],
+            timed_out_sources=result.get("timed_out_sources", []),
+            context_tokens=result.get("context_tokens", 0),
+            cache_hit=result.get("cache_hit", False),
         )
     except Exception as e:
         logger.error(f"Error in /ask: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_jarvis_stream(req: AskRequest):
+    """
+    Variante SSE de /ask: emite `sources` apenas termina la búsqueda,
+    luego `token` por cada fragmento de Gemini y `done` con correlation_id y tiempos.
+    """
+    async def event_stream():
+        try:
+            async for item in rag_system.answer_stream(req.question):
+                yield _sse_event(item["event"], item["data"])
+        except Exception as e:
+            logger.error(f"Error in /ask/stream: {e}")
+            yield _sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/tts")
 def generate_tts(req: TTSRequest):
     if not settings.TTS_ENABLED:
@@ -153,6 +231,9 @@ def submit_feedback(req: FeedbackRequest):
         
     try:
         jarvis_telemetry.log_feedback(req.correlation_id, req.is_helpful)
+        if not req.is_helpful and answer_cache is not None:
+            # Una respuesta mala no debe seguir sirviéndose desde el cache
+            answer_cache.invalidate_for_feedback(req.correlation_id)
         return {"status": "ok"}
     except Exception as e:
         logger.error(f"Error in /telemetry/feedback: {e}")
@@ -171,7 +252,8 @@ async def analyze_document(
         
         required_placeholders = json.loads(placeholders) if placeholders else []
         
-        placeholders_found, usage = analyze_text_with_llm(extracted_text, required_placeholders)
+        # Cliente OpenAI y cache SQLite son bloqueantes: fuera del event loop
+        placeholders_found, usage = await io_executor.run(analyze_text_with_llm, extracted_text, required_placeholders)
 
         # Telemetría IA
         try:
@@ -187,25 +269,24 @@ async def analyze_document(
                 completion_tokens=completion_tokens,
             )
 
-            asyncio.create_task(
-                log_ai_usage(
-                    tenant_id=tenant_id,
-                    user_id=user_id,
-                    feature="DOCWORKS_ANALYZE",
-                    provider="openai",
-                    model="gpt-4o",
-                    prompt_tokens=prompt_tokens,
-                    completion_tokens=completion_tokens,
-                    total_tokens=total_tokens,
-                    cost_usd=cost_usd,
-                    latency_ms=latency_ms,
-                    correlation_id=None,
-                    source="ai-service",
-                    metadata={"endpoint": "/analyze-document"},
-                )
+            # Solo encola: ai_usage_shipper lo envía en lote al API core
+            log_ai_usage(
+                tenant_id=tenant_id,
+                user_id=user_id,
+                feature="DOCWORKS_ANALYZE",
+                provider="openai",
+                model="gpt-4o",
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=total_tokens,
+                cost_usd=cost_usd,
+                latency_ms=latency_ms,
+                correlation_id=None,
+                source="ai-service",
+                metadata={"endpoint": "/analyze-document", "cached": usage.get("cached", False)},
             )
         except Exception as e:
-            logger.error(f"Error scheduling telemetry task: {e}", exc_info=True)
+            logger.error(f"Error queuing AI telemetry: {e}", exc_info=True)
 
         return AnalysisResult(
             extracted_text_length=len(extracted_text),
@@ -0,0 +1,63 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.core.ai.gemini_client import gemini_client
+from app.core.ai.llm_cache import llm_cache
+from app.core.executors import executor_stats
+from app.core.metrics import cache_requests, render_counters, render_gauges, source_requests, stage_duration
+from app.core.rag.knowledge_base import knowledge_base
+from app.core.rag.multi_source_search import cache as external_cache
+from app.core.rag.rag_system import answer_cache
+from app.core.rag.source_router import EXTERNAL_SOURCES
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, get_breaker
+from app.services.telemetry import TelemetryLogger
+
+router = APIRouter(tags=["metrics"])
+
+CIRCUIT_STATES = (CLOSED, HALF_OPEN, OPEN)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Métricas en formato de texto Prometheus (histogramas por etapa, caches, colas)."""
+    lines = []
+    lines += stage_duration.render()
+    lines += source_requests.render()
+    lines += cache_requests.render()
+
+    hit_ratios = [
+        ({"cache": "query_embedding"}, knowledge_base.query_cache.stats()["hit_ratio"]),
+        ({"cache": "external"}, external_cache.stats()["hit_ratio"]),
+        ({"cache": "llm"}, llm_cache.stats()["hit_rate"]),
+    ]
+    if answer_cache is not None:
+        hit_ratios.append(({"cache": "answer"}, answer_cache.stats()["hit_rate"]))
+    lines += render_gauges("jarvis_cache_hit_ratio", "Hit ratio acumulado de cada cache desde el arranque.", hit_ratios)
+
+    executors = executor_stats()
+    lines += render_gauges(
+        "jarvis_executor_queue_depth", "Tareas esperando en cada pool acotado.",
+        [({"pool": name}, s["queue_depth"]) for name, s in executors.items()],
+    )
+    lines += render_gauges(
+        "jarvis_executor_active", "Tareas en ejecución en cada pool acotado.",
+        [({"pool": name}, s["active"]) for name, s in executors.items()],
+    )
+
+    telemetry = TelemetryLogger.instance().stats()
+    lines += render_gauges("jarvis_telemetry_queue_depth", "Escrituras de telemetría pendientes.", [({}, telemetry["queued"])])
+    lines += render_counters("jarvis_telemetry_dropped_total", "Escrituras de telemetría descartadas por cola llena.", [({}, telemetry["dropped"])])
+
+    gemini = gemini_client.stats()
+    lines += render_counters("jarvis_gemini_calls_total", "Llamadas a Gemini.", [({}, gemini["calls"])])
+    lines += render_counters("jarvis_gemini_retries_total", "Reintentos de llamadas a Gemini.", [({}, gemini["retries"])])
+    lines += render_counters("jarvis_gemini_failures_total", "Llamadas a Gemini que fallaron tras agotar los reintentos.", [({}, gemini["failures"])])
+
+    lines += render_gauges(
+        "jarvis_circuit_state", "Estado del circuit breaker de cada scraper (1 = estado actual).",
+        [
+            ({"source": name, "state": state}, 1 if get_breaker(name).state == state else 0)
+            for name in EXTERNAL_SOURCES
+            for state in CIRCUIT_STATES
+        ],
+    )
+
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
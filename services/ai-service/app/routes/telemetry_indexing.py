@@ -1,5 +1,8 @@
 from fastapi import APIRouter
+from app.core.ai.llm_cache import llm_cache
 from app.core.rag.knowledge_base import knowledge_base
+from app.core.rag.multi_source_search import cache as external_cache, cache_sweeper
+from app.core.rag.rag_system import answer_cache
 import json
 import os
 import time
@@ -33,4 +36,8 @@ def get_indexing_status():
         "timestamp": int(time.time()),
         "counts": counts,
         "indexing_progress": progress,
+        "query_embedding_cache": knowledge_base.query_cache.stats(),
+        "external_search_cache": {**external_cache.stats(), "sweeper": cache_sweeper.stats()},
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "llm_cache": llm_cache.stats(),
     }
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
-from app.services.scrapers.pjud_scraper_playwright_v2 import pjud_scraper_v2
+from app.core.rag.source_router import latency_model
+from app.services.circuit_breaker import get_breaker
+from app.services.scrapers.pjud_scraper_playwright_v2 import quick_health_check as pjud_health_check
 from app.services.scrapers.bcn_scraper import quick_health_check as bcn_health_check
 from app.services.scrapers.scielo_scraper import quick_health_check as scielo_health_check
 
@@ -10,11 +12,13 @@ def scrapers_health():
     """
     Realiza pruebas rápidas en los scrapers PJUD/BCN/SciELO.
     NO hace scraping intensivo, solo verifica reachability básica.
+    Incluye el estado del circuit breaker de cada fuente y la latencia
+    esperada que usa el router de fuentes.
     """
     pjud_ok = False
     pjud_error = None
     try:
-        pjud_ok = pjud_scraper_v2.health_check()
+        pjud_ok = pjud_health_check()
     except Exception as e:
         pjud_error = str(e)
 
@@ -33,7 +37,8 @@ def scrapers_health():
         scielo_error = str(e)
 
     return {
-        "pjud": {"ok": pjud_ok, "error": pjud_error},
-        "bcn": {"ok": bcn_ok, "error": bcn_error},
-        "scielo": {"ok": scielo_ok, "error": scielo_error},
+        "pjud": {"ok": pjud_ok, "error": pjud_error, "circuit": get_breaker("pjud").snapshot()},
+        "bcn": {"ok": bcn_ok, "error": bcn_error, "circuit": get_breaker("bcn").snapshot()},
+        "scielo": {"ok": scielo_ok, "error": scielo_error, "circuit": get_breaker("scielo").snapshot()},
+        "routing_cost_model": latency_model.snapshot(),
     }
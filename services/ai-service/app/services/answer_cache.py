@@ -0,0 +1,269 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def source_id(result: Dict[str, Any]) -> str:
+    """Identificador estable de un resultado (id de Chroma o campo natural del scraper)."""
+    meta = result.get("metadata") or {}
+    natural = result.get("id") or meta.get("rol") or meta.get("id_norma") or meta.get("url") or meta.get("url_html")
+    if not natural:
+        natural = hashlib.sha1((result.get("document") or "").encode("utf-8")).hexdigest()[:12]
+    return f"{result.get('source_type', 'unknown')}:{natural}"
+
+
+def sources_fingerprint(sources: List[Dict[str, Any]]) -> str:
+    """Huella del conjunto de fuentes recuperadas (independiente del orden)."""
+    raw = "|".join(sorted(source_id(s) for s in sources))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize(vector: List[float]) -> np.ndarray:
+    vec = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+class AnswerCache:
+    """
+    Cache semántico de respuestas RAG indexado por el embedding de la pregunta.
+
+    Cada entrada guarda respuesta, fuentes, huella de las fuentes y la huella
+    de la KB vigente al responder. Un hit exige similitud coseno sobre el
+    umbral, TTL vigente y la misma huella de KB (si la KB cambió, la respuesta
+    pudo haber cambiado). El feedback negativo invalida la entrada que
+    originó la respuesta y las que se apoyan en el mismo conjunto de fuentes.
+
+    Las entradas viven en SQLite; los embeddings además en una matriz en
+    memoria para que el lookup sea un producto punto (sin Chroma, para no
+    alterar la KB que se está versionando).
+    """
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or settings.ANSWER_CACHE_DB_PATH
+        self.threshold = settings.ANSWER_CACHE_SIMILARITY_THRESHOLD
+        self.ttl_seconds = settings.ANSWER_CACHE_TTL_SECONDS
+        self.max_entries = settings.ANSWER_CACHE_MAX_ENTRIES
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache_entry (
+                entry_id TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                sources_fingerprint TEXT NOT NULL,
+                kb_fingerprint TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_sources ON answer_cache_entry (sources_fingerprint)")
+        # Respuestas servidas (originales y hits) -> entrada, para aplicar el feedback
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache_served (
+                correlation_id TEXT PRIMARY KEY,
+                entry_id TEXT NOT NULL,
+                served_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_served_at ON answer_cache_served (served_at)")
+        self._conn.commit()
+
+        self._ids: List[str] = []
+        self._kb_fps: List[str] = []
+        self._created: List[float] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._load()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _load(self) -> None:
+        min_created = time.time() - self.ttl_seconds
+        rows = self._conn.execute(
+            "SELECT entry_id, embedding, kb_fingerprint, created_at FROM answer_cache_entry "
+            "WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?",
+            (min_created, self.max_entries),
+        ).fetchall()
+        rows.reverse()
+        self._ids = [r[0] for r in rows]
+        self._kb_fps = [r[2] for r in rows]
+        self._created = [r[3] for r in rows]
+        vectors = [np.frombuffer(r[1], dtype=np.float32) for r in rows]
+        self._matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        logger.info(f"Answer cache loaded: {len(self._ids)} entries")
+
+    def lookup(self, embedding: List[float], kb_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Devuelve {"entry_id", "question", "answer", "sources", "similarity"} o None."""
+        query = _normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if not self._ids or self._matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            sims = self._matrix @ query
+            # Candidatos en orden de similitud; se salta lo vencido o de otra versión de la KB
+            for idx in np.argsort(-sims):
+                sim = float(sims[idx])
+                if sim < self.threshold:
+                    break
+                if self._kb_fps[idx] != kb_fingerprint or now - self._created[idx] > self.ttl_seconds:
+                    continue
+                entry_id = self._ids[idx]
+                row = self._conn.execute(
+                    "SELECT question, answer, sources FROM answer_cache_entry WHERE entry_id = ?", (entry_id,)
+                ).fetchone()
+                if row is None:
+                    continue
+                self._conn.execute("UPDATE answer_cache_entry SET hits = hits + 1 WHERE entry_id = ?", (entry_id,))
+                self._conn.commit()
+                self.hits += 1
+                return {
+                    "entry_id": entry_id,
+                    "question": row[0],
+                    "answer": row[1],
+                    "sources": json.loads(row[2]),
+                    "similarity": sim,
+                }
+            self.misses += 1
+            return None
+
+    def store(
+        self,
+        question: str,
+        embedding: List[float],
+        answer: str,
+        sources: List[Dict[str, Any]],
+        kb_fingerprint: str,
+        correlation_id: str,
+    ) -> str:
+        entry_id = uuid.uuid4().hex
+        vec = _normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO answer_cache_entry
+                    (entry_id, question, embedding, answer, sources, sources_fingerprint, kb_fingerprint, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    entry_id,
+                    question,
+                    vec.tobytes(),
+                    answer,
+                    json.dumps(sources, ensure_ascii=False, default=str),
+                    sources_fingerprint(sources),
+                    kb_fingerprint,
+                    now,
+                ),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache_served (correlation_id, entry_id, served_at) VALUES (?, ?, ?)",
+                (correlation_id, entry_id, now),
+            )
+            self._conn.execute("DELETE FROM answer_cache_served WHERE served_at < ?", (now - self.ttl_seconds,))
+            self._conn.commit()
+
+            # La KB cambió desde que se guardaron: esas respuestas ya no son válidas
+            outdated = [eid for eid, fp in zip(self._ids, self._kb_fps) if fp != kb_fingerprint]
+            if outdated:
+                self._delete(outdated)
+                self.invalidations += len(outdated)
+
+            if self._matrix.size and self._matrix.shape[1] != vec.shape[0]:
+                # Cambió el modelo de embeddings: lo anterior no es comparable
+                self._ids, self._kb_fps, self._created = [], [], []
+                self._matrix = np.zeros((0, 0), dtype=np.float32)
+            self._ids.append(entry_id)
+            self._kb_fps.append(kb_fingerprint)
+            self._created.append(now)
+            self._matrix = vec[None, :] if not self._matrix.size else np.vstack([self._matrix, vec])
+            if len(self._ids) > self.max_entries:
+                self._evict_oldest(len(self._ids) - self.max_entries)
+        return entry_id
+
+    def record_served(self, correlation_id: str, entry_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache_served (correlation_id, entry_id, served_at) VALUES (?, ?, ?)",
+                (correlation_id, entry_id, time.time()),
+            )
+            self._conn.commit()
+
+    def invalidate_for_feedback(self, correlation_id: str) -> int:
+        """
+        Feedback negativo: elimina la entrada que produjo esa respuesta y las
+        que comparten su huella de fuentes. Devuelve cuántas entradas se borraron.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT e.sources_fingerprint FROM answer_cache_served s "
+                "JOIN answer_cache_entry e ON e.entry_id = s.entry_id WHERE s.correlation_id = ?",
+                (correlation_id,),
+            ).fetchone()
+            if row is None:
+                return 0
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT entry_id FROM answer_cache_entry WHERE sources_fingerprint = ?", (row[0],)
+            )]
+            self._delete(ids)
+            self.invalidations += len(ids)
+        logger.info(f"Answer cache: invalidated {len(ids)} entries after negative feedback on {correlation_id}")
+        return len(ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM answer_cache_entry")
+            self._conn.execute("DELETE FROM answer_cache_served")
+            self._conn.commit()
+            self._ids, self._kb_fps, self._created = [], [], []
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def _evict_oldest(self, n: int) -> None:
+        # Llamar con el lock tomado; las entradas en memoria están en orden de inserción
+        self._delete(self._ids[:n])
+
+    def _delete(self, entry_ids: List[str]) -> None:
+        # Llamar con el lock tomado
+        if not entry_ids:
+            return
+        placeholders = ",".join("?" * len(entry_ids))
+        self._conn.execute(f"DELETE FROM answer_cache_entry WHERE entry_id IN ({placeholders})", entry_ids)
+        self._conn.execute(f"DELETE FROM answer_cache_served WHERE entry_id IN ({placeholders})", entry_ids)
+        self._conn.commit()
+        drop = set(entry_ids)
+        keep = [i for i, eid in enumerate(self._ids) if eid not in drop]
+        self._ids = [self._ids[i] for i in keep]
+        self._kb_fps = [self._kb_fps[i] for i in keep]
+        self._created = [self._created[i] for i in keep]
+        self._matrix = self._matrix[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "invalidations": self.invalidations,
+            "similarity_threshold": self.threshold,
+        }
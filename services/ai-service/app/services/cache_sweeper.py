@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.core.executors import io_executor
+from app.services.external_search_cache import ExternalSearchCache
+
+logger = logging.getLogger(__name__)
+
+class ExternalCacheSweeper:
+    """
+    Tarea de fondo que mantiene acotado el cache externo:
+    borra entradas vencidas en lotes, aplica el tope de entradas (LRU)
+    y compacta el archivo SQLite cuando hubo muchos borrados.
+    """
+    def __init__(
+        self,
+        cache: ExternalSearchCache,
+        interval_seconds: int | None = None,
+        max_entries: int | None = None,
+        batch_size: int | None = None,
+    ):
+        self.cache = cache
+        self.interval_seconds = interval_seconds or settings.EXTERNAL_CACHE_SWEEP_INTERVAL_SECONDS
+        self.max_entries = max_entries or settings.EXTERNAL_CACHE_MAX_ENTRIES
+        self.batch_size = batch_size or settings.EXTERNAL_CACHE_SWEEP_BATCH
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.expired_deleted = 0
+        self.evictions = 0
+        self.last_sweep_at: Optional[float] = None
+        self.last_sweep_duration_ms: Optional[int] = None
+        self.last_error: Optional[str] = None
+
+    def sweep_once(self) -> Dict[str, int]:
+        """Un ciclo completo (bloqueante; se ejecuta en un thread)."""
+        start = time.perf_counter()
+        expired = self.cache.delete_expired(self.batch_size)
+        evicted = self.cache.evict_lru(self.max_entries, self.batch_size)
+        if expired + evicted >= self.batch_size:
+            self.cache.compact()
+
+        self.runs += 1
+        self.expired_deleted += expired
+        self.evictions += evicted
+        self.last_sweep_at = time.time()
+        self.last_sweep_duration_ms = int((time.perf_counter() - start) * 1000)
+        logger.info(
+            f"External cache sweep: {expired} expired, {evicted} evicted in {self.last_sweep_duration_ms} ms"
+        )
+        return {"expired": expired, "evicted": evicted}
+
+    async def _run(self):
+        while True:
+            try:
+                await io_executor.run(self.sweep_once)
+                self.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error sweeping external cache: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_entries": self.max_entries,
+            "runs": self.runs,
+            "expired_deleted": self.expired_deleted,
+            "evictions": self.evictions,
+            "last_sweep_at": self.last_sweep_at,
+            "last_sweep_duration_ms": self.last_sweep_duration_ms,
+            "last_error": self.last_error,
+        }
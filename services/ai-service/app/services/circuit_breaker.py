@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Se levanta cuando una fuente se omite porque su circuito está abierto."""
+    pass
+
+class CircuitBreaker:
+    """
+    Circuit breaker por fuente externa (closed / open / half-open).
+
+    Evalúa una ventana deslizante de llamadas recientes: si la tasa de fallas
+    (errores + llamadas más lentas que `slow_call_seconds`) supera el umbral,
+    el circuito se abre y las llamadas se omiten al instante. Tras
+    `open_seconds` pasa a half-open y deja pasar llamadas de prueba: un
+    éxito lo cierra, una falla lo vuelve a abrir.
+    """
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float | None = None,
+        min_calls: int | None = None,
+        failure_rate_threshold: float | None = None,
+        slow_call_seconds: float | None = None,
+        open_seconds: float | None = None,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds or settings.CIRCUIT_BREAKER_WINDOW_SECONDS
+        self.min_calls = min_calls or settings.CIRCUIT_BREAKER_MIN_CALLS
+        self.failure_rate_threshold = failure_rate_threshold or settings.CIRCUIT_BREAKER_FAILURE_RATE
+        self.slow_call_seconds = slow_call_seconds or settings.CIRCUIT_BREAKER_SLOW_CALL_SECONDS
+        self.open_seconds = open_seconds or settings.CIRCUIT_BREAKER_OPEN_SECONDS
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._calls: deque = deque()  # (timestamp, failed, latency_s)
+        self._state = CLOSED
+        self._opened_at: Optional[float] = None
+        self._half_open_in_flight = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+    def _transition(self, state: str, now: float) -> None:
+        if state != self._state:
+            logger.warning(f"Circuit breaker {self.name}: {self._state} -> {state}")
+        self._state = state
+        if state == OPEN:
+            self._opened_at = now
+        elif state == CLOSED:
+            self._opened_at = None
+            self._calls.clear()
+        self._half_open_in_flight = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open(time.time())
+            return self._state
+
+    def _maybe_half_open(self, now: float) -> None:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, now)
+
+    def allow_request(self) -> bool:
+        """True si la llamada puede ir a la fuente; False si debe omitirse."""
+        with self._lock:
+            now = time.time()
+            self._maybe_half_open(now)
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool, latency_s: float, error: Optional[str] = None) -> None:
+        failed = (not ok) or latency_s > self.slow_call_seconds
+        with self._lock:
+            now = time.time()
+            if error:
+                self.last_error = error
+            if self._state == HALF_OPEN:
+                self._transition(OPEN if failed else CLOSED, now)
+                return
+            self._calls.append((now, failed, latency_s))
+            self._trim(now)
+            if self._state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, f, _ in self._calls if f)
+                if failures / len(self._calls) >= self.failure_rate_threshold:
+                    self._transition(OPEN, now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            self._maybe_half_open(now)
+            self._trim(now)
+            calls = len(self._calls)
+            failures = sum(1 for _, f, _ in self._calls if f)
+            latencies = sorted(l for _, _, l in self._calls)
+            return {
+                "state": self._state,
+                "window_calls": calls,
+                "window_failures": failures,
+                "failure_rate": round(failures / calls, 3) if calls else 0.0,
+                "p50_latency_ms": int(latencies[len(latencies) // 2] * 1000) if latencies else None,
+                "opened_at": self._opened_at,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+            }
+
+# Un breaker por fuente externa
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(source_name: str) -> CircuitBreaker:
+    with _registry_lock:
+        breaker = _breakers.get(source_name)
+        if breaker is None:
+            breaker = _breakers[source_name] = CircuitBreaker(source_name)
+        return breaker
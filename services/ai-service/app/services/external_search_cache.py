@@ -1,124 +1,420 @@
 import os
+import json
 import time
+import hashlib
 import logging
-from typing import List, Dict, Optional
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, List, Dict, Optional, Tuple
+from app.config import settings
+from app.core.metrics import cache_requests, span
+from app.core.rag.embedding_cache import normalize_query
 from app.core.rag.knowledge_base import KnowledgeBase, EXTERNAL_CACHE_COLLECTION
 
 logger = logging.getLogger(__name__)
 
+def cache_key(query: str, source: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Clave exacta: hash(query normalizada, fuente, parámetros)."""
+    raw = json.dumps([normalize_query(query), source, params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
 class ExternalSearchCache:
-    def __init__(self, kb: KnowledgeBase, ttl_days: int | None = None):
+    """
+    Cache de resultados de fuentes externas (PJUD, BCN, SciELO) en dos niveles:
+
+    1. Exacto: tabla SQLite indexada por hash(query normalizada, fuente, params).
+       Las repeticiones exactas no pagan embedding ni búsqueda vectorial.
+    2. Semántico (opcional): la query se guarda una vez por clave en la colección
+       `external_cache` de Chroma; si el nivel exacto falla, se busca la query
+       cacheada más parecida y se acepta solo sobre un umbral de similitud.
+
+    `get` devuelve los items crudos tal como los entregó el scraper.
+    Con stale-while-revalidate, `lookup` también entrega entradas vencidas
+    (dentro de un periodo de gracia) marcadas como stale, para que el caller
+    las sirva de inmediato y refresque en segundo plano.
+    """
+    def __init__(
+        self,
+        kb: KnowledgeBase,
+        ttl_days: int | None = None,
+        db_path: str | None = None,
+        semantic_fallback: bool | None = None,
+        similarity_threshold: float | None = None,
+    ):
         self.kb = kb
         self.ttl_seconds = (ttl_days or int(os.environ.get("EXTERNAL_CACHE_TTL_DAYS", 7))) * 86400
         self.collection = EXTERNAL_CACHE_COLLECTION
+        self.semantic_fallback = settings.EXTERNAL_CACHE_SEMANTIC_FALLBACK if semantic_fallback is None else semantic_fallback
+        self.similarity_threshold = similarity_threshold or settings.EXTERNAL_CACHE_SIMILARITY_THRESHOLD
+        self.stale_while_revalidate = settings.EXTERNAL_CACHE_STALE_WHILE_REVALIDATE
+        self.stale_grace_seconds = settings.EXTERNAL_CACHE_STALE_GRACE_DAYS * 86400 if self.stale_while_revalidate else 0
+
+        self.negative_ttl_seconds = settings.EXTERNAL_CACHE_NEGATIVE_TTL_SECONDS
+        self.error_ttl_seconds = settings.EXTERNAL_CACHE_ERROR_TTL_SECONDS
+        self.rate_limit_ttl_seconds = settings.EXTERNAL_CACHE_RATE_LIMIT_TTL_SECONDS
 
-    def get(self, query: str, source: str) -> List[Dict]:
+        self.db_path = db_path or settings.EXTERNAL_CACHE_DB_PATH
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS external_cache_entry (
+                cache_key TEXT PRIMARY KEY,
+                source_type TEXT NOT NULL,
+                query_text TEXT NOT NULL,
+                params TEXT,
+                results TEXT NOT NULL,
+                cached_at REAL NOT NULL,
+                last_accessed_at REAL
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(external_cache_entry)")}
+        if "last_accessed_at" not in columns:
+            self._conn.execute("ALTER TABLE external_cache_entry ADD COLUMN last_accessed_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_external_cache_cached_at ON external_cache_entry (cached_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_external_cache_accessed ON external_cache_entry (last_accessed_at)")
+        # Cache negativo: búsquedas vacías o fallidas, con TTL corto propio
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS external_cache_negative (
+                cache_key TEXT PRIMARY KEY,
+                source_type TEXT NOT NULL,
+                error_class TEXT NOT NULL,
+                cached_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_external_cache_negative_expires ON external_cache_negative (expires_at)")
+        self._conn.commit()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, query: str, source: str, params: Optional[Dict[str, Any]] = None) -> List[Dict]:
         """
         Retrieve cached results for a query and source.
-        Checks TTL.
+        Checks TTL. Exact key first, semantic tier only if enabled.
         """
+        results, stale = self.lookup(query, source, params)
+        return [] if stale else results
+
+    def lookup(self, query: str, source: str, params: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict], bool]:
+        """
+        Como `get`, pero devuelve (items, stale). Una entrada vencida se
+        entrega con stale=True solo si stale-while-revalidate está activo y
+        no superó el periodo de gracia; en otro caso es un miss.
+        """
+        with span("external_cache.lookup", source=source):
+            results, stale, outcome = self._lookup(query, source, params)
+        cache_requests.inc(cache="external", result=outcome, source=source)
+        return results, stale
+
+    def _lookup(self, query: str, source: str, params: Optional[Dict[str, Any]]) -> Tuple[List[Dict], bool, str]:
         try:
-            # Search in cache collection using the query text
-            # We assume the 'document' field in cache stores the query or a representation of it,
-            # OR we rely on semantic similarity of the query to cached queries.
-            # However, exact match on query string is safer for a cache.
-            # Since Chroma is vector store, we search by vector.
-            # To do exact match, we would need metadata filtering on 'query_text'.
-            # Assuming we store 'query_text' in metadata.
-            
-            # Note: KnowledgeBase.search returns list of dicts with 'metadata' and 'document'.
-            # We need to filter by source and query_text if possible, or just rely on similarity.
-            # For a strict cache, we want exact query match.
-            # But KnowledgeBase.search is semantic.
-            # Let's try to filter by metadata if KB supports it, otherwise post-filter.
-            
-            # Mocking metadata filter support in KB.search if it existed, but standard Chroma supports it.
-            # We'll assume KB.search takes a filter dict if we modified it, but we didn't.
-            # So we'll search top_k=10 and filter manually.
-            
-            results = self.kb.search(self.collection, query, top_k=20)
-            
-            valid_hits = []
-            now = time.time()
-            
-            for res in results:
-                meta = res.get("metadata", {})
-                
-                # Check source
-                if meta.get("source_type") != source:
-                    continue
-                    
-                # Check query match (optional, if we want strict cache)
-                # If we want semantic cache, we skip this. Let's stick to semantic for RAG.
-                # But prompt says "Buscar... por embedding de query o por clave textual".
-                
-                # Check TTL
-                cached_at = meta.get("cached_at", 0)
-                if now - cached_at > self.ttl_seconds:
-                    continue
-                    
-                valid_hits.append(res)
-                
-            return valid_hits
-            
+            key = cache_key(query, source, params)
+            entry = self._get_exact(key, max_age=self.ttl_seconds + self.stale_grace_seconds)
+            if entry is not None:
+                results, cached_at = entry
+                if time.time() - cached_at <= self.ttl_seconds:
+                    self.exact_hits += 1
+                    return results, False, "hit"
+                fresh_semantic = self._get_semantic(query, source, params) if self.semantic_fallback else None
+                if fresh_semantic is not None:
+                    self.semantic_hits += 1
+                    return fresh_semantic, False, "semantic_hit"
+                self.stale_hits += 1
+                return results, True, "stale"
+
+            if self.semantic_fallback:
+                results = self._get_semantic(query, source, params)
+                if results is not None:
+                    self.semantic_hits += 1
+                    return results, False, "semantic_hit"
+
+            self.misses += 1
+            return [], False, "miss"
+
         except Exception as e:
             logger.error(f"Error reading external cache: {e}")
-            return []
+            return [], False, "error"
+
+    def _get_exact(self, key: str, max_age: Optional[float] = None) -> Optional[Tuple[List[Dict], float]]:
+        now = time.time()
+        max_age = self.ttl_seconds if max_age is None else max_age
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results, cached_at FROM external_cache_entry WHERE cache_key = ? AND cached_at >= ?",
+                (key, now - max_age),
+            ).fetchone()
+            if row is None:
+                return None
+            # Marca de acceso para la evicción LRU del sweeper
+            self._conn.execute(
+                "UPDATE external_cache_entry SET last_accessed_at = ? WHERE cache_key = ?", (now, key)
+            )
+            self._conn.commit()
+        return json.loads(row[0]), row[1]
 
-    def set(self, query: str, source: str, results: List[Dict]) -> None:
+    def _get_semantic(self, query: str, source: str, params: Optional[Dict[str, Any]]) -> Optional[List[Dict]]:
+        min_cached_at = time.time() - self.ttl_seconds
+        where = {"$and": [
+            {"entry_type": "query"},
+            {"source_type": source},
+            {"params_hash": cache_key("", source, params)},
+            {"cached_at": {"$gte": min_cached_at}},
+        ]}
+        hits = self.kb.search(self.collection, query, top_k=1, where=where)
+        if not hits or hits[0].get("score", 0.0) < self.similarity_threshold:
+            return None
+        entry = self._get_exact(hits[0]["id"])
+        if entry is None:
+            return None
+        logger.info(f"Semantic cache hit for {source} (score={hits[0]['score']:.3f})")
+        return entry[0]
+
+    def set(self, query: str, source: str, results: List[Dict], params: Optional[Dict[str, Any]] = None) -> None:
         """
-        Cache results.
+        Cache results. Una entrada por clave: un `set` repetido la reemplaza.
         """
         if not results:
             return
-            
+
         try:
-            documents = []
-            metadatas = []
-            ids = []
-            now = time.time()
-            
-            for i, res in enumerate(results):
-                # Construct a document content representation
-                # Could be the title + summary
-                content = f"{res.get('titulo', '')} {res.get('resumen', '')} {res.get('caratulado', '')}"
-                
-                meta = res.copy()
-                # Flatten metadata if needed (Chroma doesn't like nested dicts)
-                # Ensure we add cache fields
-                meta["source_type"] = source
-                meta["cached_at"] = now
-                meta["query_text"] = query
-                
-                # Clean metadata values to be strings/ints/floats
-                clean_meta = {}
-                for k, v in meta.items():
-                    if isinstance(v, (str, int, float, bool)):
-                        clean_meta[k] = v
-                    elif v is None:
-                        pass # Skip None
-                    else:
-                        clean_meta[k] = str(v) # Stringify lists/dicts
-                
-                documents.append(content)
-                metadatas.append(clean_meta)
-                ids.append(f"cache_{source}_{now}_{i}")
-                
-            self.kb.add_documents(self.collection, documents, metadatas, ids)
-            
+            with span("external_cache.set", source=source):
+                self._set(query, source, results, params)
         except Exception as e:
             logger.error(f"Error writing to external cache: {e}")
 
+    def _set(self, query: str, source: str, results: List[Dict], params: Optional[Dict[str, Any]]) -> None:
+        key = cache_key(query, source, params)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO external_cache_entry
+                    (cache_key, source_type, query_text, params, results, cached_at, last_accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    key,
+                    source,
+                    query,
+                    json.dumps(params or {}, sort_keys=True),
+                    json.dumps(results, ensure_ascii=False, default=str),
+                    now,
+                    now,
+                ),
+            )
+            self._conn.execute("DELETE FROM external_cache_negative WHERE cache_key = ?", (key,))
+            self._conn.commit()
+
+        if self.semantic_fallback:
+            # La query (no los resultados) es lo que se compara en el nivel semántico
+            self.kb.add_documents(
+                self.collection,
+                ids=[key],
+                texts=[query],
+                metadatas=[{
+                    "entry_type": "query",
+                    "source_type": source,
+                    "params_hash": cache_key("", source, params),
+                    "cached_at": now,
+                    "query_text": query,
+                }],
+            )
+
+    def _negative_ttl(self, error_class: str) -> int:
+        if error_class == "empty":
+            return self.negative_ttl_seconds
+        if "RateLimit" in error_class:
+            return self.rate_limit_ttl_seconds
+        return self.error_ttl_seconds
+
+    def get_negative(self, query: str, source: str, params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Devuelve la clase de error ("empty" o el nombre de la excepción) si hay
+        una entrada negativa vigente para la query, o None.
+        """
+        error_class = self._negative_entry(query, source, params)
+        if error_class is not None:
+            self.negative_hits += 1
+            cache_requests.inc(cache="external", result="negative", source=source)
+        return error_class
+
+    def is_negative(self, query: str, source: str, params: Optional[Dict[str, Any]] = None) -> bool:
+        """Como get_negative, pero sin contar en las métricas (chequeos internos, p.ej. refrescos)."""
+        return self._negative_entry(query, source, params) is not None
+
+    def _negative_entry(self, query: str, source: str, params: Optional[Dict[str, Any]]) -> Optional[str]:
+        try:
+            key = cache_key(query, source, params)
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT error_class FROM external_cache_negative WHERE cache_key = ? AND expires_at > ?",
+                    (key, time.time()),
+                ).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error reading negative cache: {e}")
+            return None
+
+    def set_negative(self, query: str, source: str, error_class: str, params: Optional[Dict[str, Any]] = None) -> None:
+        """Registra una búsqueda vacía (error_class="empty") o fallida por fuente y clase de error."""
+        try:
+            key = cache_key(query, source, params)
+            now = time.time()
+            with self._lock:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO external_cache_negative
+                        (cache_key, source_type, error_class, cached_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (key, source, error_class, now, now + self._negative_ttl(error_class)),
+                )
+                self._conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing negative cache: {e}")
+
+    def _delete_keys(self, keys: List[str]) -> None:
+        if not keys:
+            return
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            self._conn.execute(f"DELETE FROM external_cache_entry WHERE cache_key IN ({placeholders})", keys)
+            self._conn.commit()
+        try:
+            # Las queries del nivel semántico usan la clave como id en Chroma
+            self.kb.delete(self.collection, ids=keys)
+        except Exception as e:
+            logger.warning(f"Error deleting semantic cache entries: {e}")
+
+    def delete_expired(self, batch_size: int = 500) -> int:
+        """
+        Elimina entradas vencidas (SQLite y Chroma) en lotes. Devuelve cuántas.
+        Con stale-while-revalidate se conservan durante el periodo de gracia.
+        """
+        now = time.time()
+        min_cached_at = now - self.ttl_seconds - self.stale_grace_seconds
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM external_cache_negative WHERE expires_at <= ?", (now,)
+            ).rowcount
+            self._conn.commit()
+        while True:
+            with self._lock:
+                keys = [row[0] for row in self._conn.execute(
+                    "SELECT cache_key FROM external_cache_entry WHERE cached_at < ? LIMIT ?",
+                    (min_cached_at, batch_size),
+                )]
+            if not keys:
+                break
+            self._delete_keys(keys)
+            deleted += len(keys)
+
+        # Chroma: lo que no tiene fila en SQLite (formato antiguo, con o sin
+        # cached_at, o un borrado que falló a medias) se elimina. Así la
+        # colección nunca supera al sidecar, que ya respeta TTL y tope LRU.
+        deleted += self.purge_orphans(batch_size)
+
+        return deleted
+
+    def purge_orphans(self, batch_size: int = 500) -> int:
+        """Elimina de la colección de Chroma los ids sin entrada en SQLite. Devuelve cuántos."""
+        try:
+            collection = self.kb.get_collection(self.collection)
+        except Exception as e:
+            logger.warning(f"Error opening semantic cache collection: {e}")
+            return 0
+        purged = 0
+        offset = 0
+        while True:
+            try:
+                page = collection.get(limit=batch_size, offset=offset, include=[])
+            except Exception as e:
+                logger.warning(f"Error scanning semantic cache entries: {e}")
+                break
+            ids = page["ids"]
+            if not ids:
+                break
+            placeholders = ",".join("?" * len(ids))
+            with self._lock:
+                known = {row[0] for row in self._conn.execute(
+                    f"SELECT cache_key FROM external_cache_entry WHERE cache_key IN ({placeholders})", ids
+                )}
+            orphans = [doc_id for doc_id in ids if doc_id not in known]
+            if orphans:
+                try:
+                    self.kb.delete(self.collection, ids=orphans)
+                except Exception as e:
+                    logger.warning(f"Error deleting orphaned semantic cache entries: {e}")
+                    break
+                purged += len(orphans)
+            # Lo borrado de esta página ya no ocupa posiciones
+            offset += len(ids) - len(orphans)
+        if purged:
+            logger.info(f"Purged {purged} orphaned entries from the {self.collection} collection")
+        return purged
+
+    def evict_lru(self, max_entries: int, batch_size: int = 500) -> int:
+        """Aplica el tope de entradas eliminando las menos usadas recientemente."""
+        evicted = 0
+        while True:
+            with self._lock:
+                size = self._conn.execute("SELECT COUNT(*) FROM external_cache_entry").fetchone()[0]
+                excess = size - max_entries
+                if excess <= 0:
+                    break
+                keys = [row[0] for row in self._conn.execute(
+                    """
+                    SELECT cache_key FROM external_cache_entry
+                    ORDER BY COALESCE(last_accessed_at, cached_at) ASC
+                    LIMIT ?
+                    """,
+                    (min(excess, batch_size),),
+                )]
+            self._delete_keys(keys)
+            evicted += len(keys)
+        return evicted
+
+    def compact(self) -> None:
+        """Recupera espacio en disco tras borrados (checkpoint del WAL + VACUUM)."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.stale_hits + self.misses
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM external_cache_entry").fetchone()[0]
+            negative_size = self._conn.execute("SELECT COUNT(*) FROM external_cache_negative").fetchone()[0]
+        return {
+            "entries": size,
+            "negative_entries": negative_size,
+            "negative_hits": self.negative_hits,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.exact_hits + self.semantic_hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
 if __name__ == "__main__":
     # Test simple
     from app.core.rag.knowledge_base import knowledge_base
-    
+
     cache = ExternalSearchCache(knowledge_base)
     print("Testing ExternalSearchCache...")
-    
+
     # Set
     cache.set("prueba", "pjud", [{"titulo": "Fallo prueba", "rol": "123-2024"}])
-    
+
     # Get
     hits = cache.get("prueba", "pjud")
     print(f"Hits found: {len(hits)}")
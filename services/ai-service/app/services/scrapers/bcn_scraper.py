@@ -121,6 +121,11 @@ async def search_legislation(
             
     return results
 
+def quick_health_check(timeout: float = 5.0) -> bool:
+    """Reachability básica de Ley Chile (sin scraping)."""
+    resp = httpx.get("https://www.leychile.cl/robots.txt", timeout=timeout, follow_redirects=True)
+    return resp.status_code < 500
+
 if __name__ == "__main__":
     import sys
     logging.basicConfig(level=logging.INFO)
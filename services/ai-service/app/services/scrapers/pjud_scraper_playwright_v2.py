@@ -2,6 +2,7 @@ import os
 import logging
 import asyncio
 import urllib.parse
+import httpx
 from typing import List, Dict, Optional
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
@@ -172,6 +173,11 @@ async def search(
     logger.info(f"PJUD search finished. Found {len(results)} results.")
     return results
 
+def quick_health_check(timeout: float = 5.0) -> bool:
+    """Reachability básica de juris.pjud.cl (HTTP, sin lanzar Chromium)."""
+    resp = httpx.get(PJUD_BASE_URL, timeout=timeout, follow_redirects=True)
+    return resp.status_code < 500
+
 if __name__ == "__main__":
     import sys
     
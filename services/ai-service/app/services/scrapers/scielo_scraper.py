@@ -125,6 +125,11 @@ async def search_scielo(
             
     return results
 
+def quick_health_check(timeout: float = 5.0) -> bool:
+    """Reachability básica de SciELO Chile (sin scraping)."""
+    resp = httpx.get(f"{SCIELO_BASE_URL}/robots.txt", timeout=timeout, follow_redirects=True)
+    return resp.status_code < 500
+
 if __name__ == "__main__":
     import sys
     logging.basicConfig(level=logging.INFO)
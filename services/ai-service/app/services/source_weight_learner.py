@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+from app.core.executors import io_executor
+from app.services.telemetry import TelemetryLogger, bump_source_weights_version
+
+logger = logging.getLogger(__name__)
+
+# Clave en telemetry_meta: último rowid de rag_feedback ya aplicado
+FEEDBACK_HWM_KEY = "feedback_hwm"
+GLOBAL_AREA = ""
+
+def weight_from_score(score: float) -> float:
+    """Misma regla que el entrenamiento original: clamp(0.5, 3.0, 1.0 + score * 0.1)."""
+    return max(0.5, min(3.0, 1.0 + score * 0.1))
+
+class SourceWeightLearner:
+    """
+    Aprendizaje incremental de pesos por fuente (globales y por área).
+
+    Cada ciclo lee solo el feedback nuevo (rowid > high-water mark), suma
+    +1 / -1 a los contadores de cada fuente del evento, y republica los
+    pesos en source_weight / source_weight_area, todo en una transacción.
+    Los contadores decaen exponencialmente (vida media configurable), así
+    el feedback antiguo pesa cada vez menos. Al final sube la versión de los
+    pesos para que los caches en proceso recarguen.
+    """
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        interval_seconds: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        half_life_days: Optional[float] = None,
+    ):
+        self.db_path = db_path or settings.TELEMETRY_DB_PATH
+        self.interval_seconds = interval_seconds or settings.SOURCE_WEIGHT_LEARNER_INTERVAL_SECONDS
+        self.batch_size = batch_size or settings.SOURCE_WEIGHT_LEARNER_BATCH
+        self.half_life_seconds = (half_life_days or settings.SOURCE_WEIGHT_HALF_LIFE_DAYS) * 86400
+        self.min_area_samples = settings.SOURCE_WEIGHT_MIN_AREA_SAMPLES
+        # Sin feedback nuevo, se republica igual cada tanto para reflejar el decaimiento
+        self.republish_seconds = 3600
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.feedback_applied = 0
+        self.last_published_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+        return self._conn
+
+    def _decay(self, elapsed_seconds: float) -> float:
+        if self.half_life_seconds <= 0:
+            return 1.0
+        return 0.5 ** (max(elapsed_seconds, 0.0) / self.half_life_seconds)
+
+    def run_once(self) -> int:
+        """Aplica un lote de feedback nuevo. Devuelve cuántos feedbacks procesó (bloqueante)."""
+        conn = self._get_conn()
+        now = time.time()
+        with conn:
+            # Lock de escritura antes de leer el high-water mark: cada worker de
+            # uvicorn (y train_source_weights.py) corre su propio learner, y dos
+            # procesos no deben aplicar el mismo lote de feedback.
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM telemetry_meta WHERE key = ?", (FEEDBACK_HWM_KEY,)).fetchone()
+            hwm = row[0] if row else 0
+            feedback = conn.execute(
+                "SELECT rowid FROM rag_feedback WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (hwm, self.batch_size),
+            ).fetchall()
+
+            if not feedback:
+                stale = self.last_published_at is None or now - self.last_published_at >= self.republish_seconds
+                if stale and self.runs:
+                    self._publish(conn, now)
+                self.runs += 1
+                return 0
+
+            new_hwm = feedback[-1][0]
+            rows = conn.execute(
+                """
+                SELECT s.source_name, f.is_helpful, r.area
+                FROM rag_feedback f
+                JOIN rag_event_source s ON s.correlation_id = f.correlation_id
+                LEFT JOIN rag_routing r ON r.correlation_id = f.correlation_id
+                WHERE f.rowid > ? AND f.rowid <= ?
+                """,
+                (hwm, new_hwm),
+            ).fetchall()
+
+            deltas: Dict[Tuple[str, str], list] = defaultdict(lambda: [0.0, 0])
+            for source_name, is_helpful, area in rows:
+                delta = 1.0 if is_helpful else -1.0
+                for key in ((GLOBAL_AREA, source_name), (area, source_name)):
+                    if key[0] is None:
+                        continue
+                    deltas[key][0] += delta
+                    deltas[key][1] += 1
+
+            for (area, source_name), (delta, count) in deltas.items():
+                current = conn.execute(
+                    "SELECT score, samples, updated_at FROM source_weight_stats WHERE area = ? AND source_name = ?",
+                    (area, source_name),
+                ).fetchone()
+                score, samples = 0.0, 0.0
+                if current:
+                    factor = self._decay(now - current[2])
+                    score, samples = current[0] * factor, current[1] * factor
+                conn.execute(
+                    """
+                    INSERT INTO source_weight_stats (area, source_name, score, samples, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(area, source_name) DO UPDATE SET
+                        score = excluded.score, samples = excluded.samples, updated_at = excluded.updated_at
+                    """,
+                    (area, source_name, score + delta, samples + count, now),
+                )
+
+            conn.execute(
+                "INSERT INTO telemetry_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (FEEDBACK_HWM_KEY, new_hwm),
+            )
+            self._publish(conn, now)
+
+        self.runs += 1
+        self.feedback_applied += len(feedback)
+        logger.info(f"Source weights updated from {len(feedback)} new feedback events (hwm={new_hwm})")
+        return len(feedback)
+
+    def _publish(self, conn: sqlite3.Connection, now: float) -> None:
+        """Recalcula los pesos publicados desde los contadores (con decaimiento a `now`)."""
+        stats = conn.execute("SELECT area, source_name, score, samples, updated_at FROM source_weight_stats").fetchall()
+        for area, source_name, score, samples, updated_at in stats:
+            factor = self._decay(now - updated_at)
+            weight = weight_from_score(score * factor)
+            if area == GLOBAL_AREA:
+                conn.execute(
+                    "INSERT INTO source_weight (source_name, weight) VALUES (?, ?) ON CONFLICT(source_name) DO UPDATE SET weight=excluded.weight",
+                    (source_name, weight),
+                )
+            elif samples * factor >= self.min_area_samples:
+                conn.execute(
+                    "INSERT INTO source_weight_area (area, source_name, weight) VALUES (?, ?, ?) ON CONFLICT(area, source_name) DO UPDATE SET weight=excluded.weight",
+                    (area, source_name, weight),
+                )
+            else:
+                # Poca evidencia (o ya decayó): el área usa el peso global
+                conn.execute("DELETE FROM source_weight_area WHERE area = ? AND source_name = ?", (area, source_name))
+        bump_source_weights_version(conn)
+        self.last_published_at = now
+
+    def catch_up(self) -> int:
+        """Procesa todo el feedback pendiente en lotes (arranque o backlog grande)."""
+        total = 0
+        while True:
+            applied = self.run_once()
+            total += applied
+            if applied < self.batch_size:
+                return total
+
+    def reset(self) -> None:
+        """
+        Borra contadores, pesos publicados y high-water mark para reaprender
+        desde todo el historial (una fuente o área sin eventos vuelve a 1.0).
+        """
+        conn = self._get_conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM source_weight_stats")
+            conn.execute("DELETE FROM source_weight")
+            conn.execute("DELETE FROM source_weight_area")
+            conn.execute("DELETE FROM telemetry_meta WHERE key = ?", (FEEDBACK_HWM_KEY,))
+            bump_source_weights_version(conn)
+
+    async def _run(self):
+        while True:
+            try:
+                applied = await io_executor.run(self.catch_up)
+                if applied:
+                    TelemetryLogger.instance().invalidate_source_weights()
+                self.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error updating source weights: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "feedback_applied": self.feedback_applied,
+            "half_life_days": self.half_life_seconds / 86400,
+            "last_published_at": self.last_published_at,
+            "last_error": self.last_error,
+        }
+
+source_weight_learner = SourceWeightLearner()
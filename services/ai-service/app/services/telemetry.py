@@ -1,12 +1,42 @@
 import sqlite3
 import logging
 import json
-from typing import List, Dict, Optional
+import queue
+import threading
+import time
+from typing import Any, List, Dict, Optional, Sequence, Tuple
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Una escritura encolada: lista de (sql, filas) que se aplican con executemany
+WriteOp = List[Tuple[str, Sequence[Sequence[Any]]]]
+
+# Clave en telemetry_meta del contador que sube cada vez que cambian los pesos
+SOURCE_WEIGHTS_VERSION_KEY = "source_weights_version"
+
+def bump_source_weights_version(conn: sqlite3.Connection) -> None:
+    """Avisa a los procesos que cachean pesos que deben recargarlos (ver train_source_weights.py)."""
+    conn.execute(
+        "INSERT INTO telemetry_meta (key, value) VALUES (?, 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + 1",
+        (SOURCE_WEIGHTS_VERSION_KEY,),
+    )
+
 class TelemetryLogger:
+    """
+    Telemetría RAG en SQLite.
+
+    Usa una sola conexión persistente en modo WAL. Las escrituras no tocan
+    la base en el request: se encolan en una cola acotada que un hilo de
+    fondo vacía en transacciones por lote. Si la cola está llena el evento
+    se descarta y se cuenta en `dropped`. `close()` vacía la cola antes de
+    cerrar (shutdown).
+
+    Las lecturas usan una segunda conexión (solo lectura, con su propio lock)
+    para no esperar detrás de una transacción del escritor; los pesos por
+    fuente los recarga un hilo aparte y el request solo lee el dict cacheado.
+    """
     _instance = None
 
     @classmethod
@@ -18,122 +48,402 @@ class TelemetryLogger:
     def __init__(self, enabled: bool = True):
         self.enabled = enabled and settings.TELEMETRY_ENABLED
         self.db_path = settings.TELEMETRY_DB_PATH
+        self.batch_size = settings.TELEMETRY_BATCH_SIZE
+        self.flush_interval = settings.TELEMETRY_FLUSH_INTERVAL_SECONDS
+
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[WriteOp]]" = queue.Queue(maxsize=settings.TELEMETRY_QUEUE_SIZE)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writer: Optional[threading.Thread] = None
+        self._read_lock = threading.Lock()
+        self._read_conn: Optional[sqlite3.Connection] = None
+
+        # Cache en proceso de los pesos: {"global": {...}, "by_area": {area: {...}}}
+        self.weights_ttl = settings.SOURCE_WEIGHTS_TTL_SECONDS
+        self.weights_version_check = settings.SOURCE_WEIGHTS_VERSION_CHECK_SECONDS
+        self._weights: Optional[Dict[str, Any]] = None
+        self._weights_version: Optional[int] = None
+        self._weights_loaded_at = 0.0
+        self._weights_checked_at = 0.0
+        self.weights_reloads = 0
+        self._weights_wakeup = threading.Event()
+        self._weights_stop = threading.Event()
+        self._weights_thread: Optional[threading.Thread] = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.write_errors = 0
+
         if self.enabled:
             self._init_db()
+            self._writer = threading.Thread(target=self._writer_loop, name="telemetry-writer", daemon=True)
+            self._writer.start()
+            self._start_weights_refresher()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")  # ~8 MB
+        return conn
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
 
     def _init_db(self):
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Tabla de pesos por fuente
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS source_weight (
-                        source_name TEXT PRIMARY KEY,
-                        weight REAL NOT NULL DEFAULT 1.0
-                    )
-                """)
-                
-                # Tabla de eventos RAG (Query + Respuesta)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS rag_event (
-                        correlation_id TEXT PRIMARY KEY,
-                        question TEXT,
-                        answer TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Tabla de fuentes usadas en un evento
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS rag_event_source (
-                        correlation_id TEXT,
-                        source_name TEXT,
-                        raw_score REAL,
-                        adjusted_score REAL,
-                        rank INTEGER,
-                        FOREIGN KEY(correlation_id) REFERENCES rag_event(correlation_id)
-                    )
-                """)
-                
-                # Tabla de feedback
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS rag_feedback (
-                        correlation_id TEXT,
-                        is_helpful INTEGER,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY(correlation_id) REFERENCES rag_event(correlation_id)
-                    )
-                """)
-                
-                # Tablas legacy o adicionales (rag_query, rag_source) pueden coexistir si se necesitan,
-                # pero aquí seguimos el esquema J-10.
-                
-                conn.commit()
+            self._conn = self._connect()
+            cursor = self._conn.cursor()
+
+            # Tabla de pesos por fuente
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS source_weight (
+                    source_name TEXT PRIMARY KEY,
+                    weight REAL NOT NULL DEFAULT 1.0
+                )
+            """)
+
+            # Tabla de eventos RAG (Query + Respuesta)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS rag_event (
+                    correlation_id TEXT PRIMARY KEY,
+                    question TEXT,
+                    answer TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Tabla de fuentes usadas en un evento
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS rag_event_source (
+                    correlation_id TEXT,
+                    source_name TEXT,
+                    raw_score REAL,
+                    adjusted_score REAL,
+                    rank INTEGER,
+                    FOREIGN KEY(correlation_id) REFERENCES rag_event(correlation_id)
+                )
+            """)
+
+            # Tabla de feedback
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS rag_feedback (
+                    correlation_id TEXT,
+                    is_helpful INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(correlation_id) REFERENCES rag_event(correlation_id)
+                )
+            """)
+
+            # Pesos por área (sobrescriben los globales para preguntas de esa área)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS source_weight_area (
+                    area TEXT NOT NULL,
+                    source_name TEXT NOT NULL,
+                    weight REAL NOT NULL DEFAULT 1.0,
+                    PRIMARY KEY (area, source_name)
+                )
+            """)
+
+            # Contadores de control (p.ej. versión de los pesos)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS telemetry_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+            # Contadores del aprendizaje incremental de pesos (area '' = global),
+            # con decaimiento exponencial aplicado desde updated_at
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS source_weight_stats (
+                    area TEXT NOT NULL,
+                    source_name TEXT NOT NULL,
+                    score REAL NOT NULL DEFAULT 0,
+                    samples REAL NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (area, source_name)
+                )
+            """)
+
+            # Decisión de ruteo de fuentes por evento (área + fuentes consultadas/omitidas)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS rag_routing (
+                    correlation_id TEXT PRIMARY KEY,
+                    area TEXT,
+                    collections TEXT,
+                    external_sources TEXT,
+                    skipped_sources TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Joins por correlation_id (aprendizaje de pesos, feedback)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_rag_event_source_correlation ON rag_event_source (correlation_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_rag_feedback_correlation ON rag_feedback (correlation_id)")
+
+            # Tablas legacy o adicionales (rag_query, rag_source) pueden coexistir si se necesitan,
+            # pero aquí seguimos el esquema J-10.
+
+            self._conn.commit()
         except Exception as e:
             logger.error(f"Error initializing telemetry DB: {e}")
 
-    def log_rag_answer(self, correlation_id: str, question: str, sources: List[Dict], answer: str):
+    # --- Cola de escritura ---
+
+    def _enqueue(self, op: WriteOp) -> None:
         if not self.enabled:
             return
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO rag_event (correlation_id, question, answer) VALUES (?, ?, ?)",
-                    (correlation_id, question, answer)
-                )
-                
-                for i, src in enumerate(sources):
-                    cursor.execute(
-                        "INSERT INTO rag_event_source (correlation_id, source_name, raw_score, adjusted_score, rank) VALUES (?, ?, ?, ?, ?)",
-                        (
-                            correlation_id,
-                            src.get("source_type", "unknown"),
-                            src.get("score", 0.0),
-                            src.get("adjusted_score", 0.0),
-                            i + 1
-                        )
-                    )
-                conn.commit()
+            self._queue.put_nowait(op)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"Telemetry queue full, dropped {self.dropped} events so far")
+
+    def _writer_loop(self) -> None:
+        while True:
+            try:
+                op = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [op]
+            # Lo que ya esté en cola entra en la misma transacción
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._write_batch([b for b in batch if b is not None])
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[WriteOp]) -> None:
+        if not batch or self._conn is None:
+            return
+        try:
+            with self._lock:
+                with self._conn:  # una transacción por lote
+                    for op in batch:
+                        self._apply(op)
+            self.written += len(batch)
+            self.batches += 1
+            return
         except Exception as e:
-            logger.error(f"Error logging RAG answer: {e}")
+            logger.warning(f"Telemetry batch of {len(batch)} events failed ({e}); retrying one by one")
+
+        # Un evento inválido no debe arrastrar al resto del lote: una transacción por evento
+        for op in batch:
+            try:
+                with self._lock:
+                    with self._conn:
+                        self._apply(op)
+                self.written += 1
+            except Exception as e:
+                self.write_errors += 1
+                logger.error(f"Dropping telemetry event ({op[0][0][:60]}...): {e}")
+        self.batches += 1
+
+    def _apply(self, op: WriteOp) -> None:
+        for sql, rows in op:
+            self._conn.executemany(sql, rows)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Espera a que se escriba lo encolado hasta ahora."""
+        if not self.enabled:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Vacía la cola, detiene el hilo escritor y cierra la conexión."""
+        if self._writer is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Telemetry queue still full at shutdown")
+        self._writer.join(timeout=timeout)
+        self._writer = None
+        self._weights_stop.set()
+        self._weights_wakeup.set()
+        if self._weights_thread is not None:
+            self._weights_thread.join(timeout=timeout)
+            self._weights_thread = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "write_errors": self.write_errors,
+            "source_weights_version": self._weights_version,
+            "source_weights_reloads": self.weights_reloads,
+        }
+
+    # --- Escrituras ---
+
+    def log_rag_answer(self, correlation_id: str, question: str, sources: List[Dict], answer: str):
+        if not self.enabled:
+            return
+        source_rows = [
+            (
+                correlation_id,
+                src.get("source_type", "unknown"),
+                src.get("score", 0.0),
+                src.get("adjusted_score", 0.0),
+                i + 1
+            )
+            for i, src in enumerate(sources)
+        ]
+        self._enqueue([
+            ("INSERT INTO rag_event (correlation_id, question, answer) VALUES (?, ?, ?)", [(correlation_id, question, answer)]),
+            ("INSERT INTO rag_event_source (correlation_id, source_name, raw_score, adjusted_score, rank) VALUES (?, ?, ?, ?, ?)", source_rows),
+        ])
 
     def log_feedback(self, correlation_id: str, is_helpful: bool):
         if not self.enabled:
             return
+        self._enqueue([
+            ("INSERT INTO rag_feedback (correlation_id, is_helpful) VALUES (?, ?)", [(correlation_id, 1 if is_helpful else 0)]),
+        ])
+
+    def log_routing(self, correlation_id: str, routing: Dict):
+        if not self.enabled:
+            return
+        self._enqueue([(
+            "INSERT OR REPLACE INTO rag_routing (correlation_id, area, collections, external_sources, skipped_sources) VALUES (?, ?, ?, ?, ?)",
+            [(
+                correlation_id,
+                routing.get("area"),
+                json.dumps(routing.get("collections", [])),
+                json.dumps(routing.get("external", [])),
+                json.dumps(routing.get("skipped", [])),
+            )],
+        )])
+
+    # --- Lecturas (conexión de solo lectura, sin el lock del escritor) ---
+
+    def _start_weights_refresher(self) -> None:
+        if self._conn is None:
+            return
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO rag_feedback (correlation_id, is_helpful) VALUES (?, ?)",
-                    (correlation_id, 1 if is_helpful else 0)
-                )
-                conn.commit()
+            self._read_conn = self._connect_reader()
+            self._load_weights()
         except Exception as e:
-            logger.error(f"Error logging feedback: {e}")
+            logger.error(f"Error loading source weights: {e}")
+        self._weights_thread = threading.Thread(target=self._weights_loop, name="telemetry-weights", daemon=True)
+        self._weights_thread.start()
+
+    def _weights_loop(self) -> None:
+        while not self._weights_stop.is_set():
+            self._weights_wakeup.wait(timeout=self.weights_version_check)
+            self._weights_wakeup.clear()
+            if self._weights_stop.is_set():
+                return
+            try:
+                self._refresh_weights_if_needed()
+            except Exception as e:
+                logger.error(f"Error refreshing source weights: {e}")
 
     def get_source_weights(self, default: float = 1.0, area: Optional[str] = None) -> Dict[str, float]:
-        # area support is optional/advanced, sticking to J-10 basic requirements first
+        """
+        Pesos por fuente desde el cache en proceso. Con `area`, los pesos de
+        esa área sobrescriben a los globales. No toca SQLite: el hilo
+        telemetry-weights recarga el dict al vencer el TTL o cuando el
+        contador de versión (lo sube el entrenamiento) cambió.
+        """
         if not self.enabled:
             return {}
+        weights = self._weights or {"global": {}, "by_area": {}}
+        if area and area in weights["by_area"]:
+            return {**weights["global"], **weights["by_area"][area]}
+        return dict(weights["global"])
+
+    def invalidate_source_weights(self) -> None:
+        """Pide una recarga inmediata en segundo plano (p.ej. tras actualizar pesos en este proceso)."""
+        self._weights_loaded_at = 0.0
+        self._weights_checked_at = 0.0
+        self._weights_wakeup.set()
+
+    def _refresh_weights_if_needed(self) -> None:
+        now = time.monotonic()
+        if self._weights is not None and now - self._weights_loaded_at < self.weights_ttl:
+            if now - self._weights_checked_at < self.weights_version_check:
+                return
+            self._weights_checked_at = now
+            if self._read_weights_version() == self._weights_version:
+                return
+        self._load_weights()
+
+    def _read_weights_version(self) -> int:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT value FROM telemetry_meta WHERE key = ?", (SOURCE_WEIGHTS_VERSION_KEY,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _load_weights(self) -> None:
+        with self._read_lock:
+            # Una sola transacción de lectura: versión y pesos del mismo snapshot
+            with self._read_conn:
+                self._read_conn.execute("BEGIN")
+                version_row = self._read_conn.execute(
+                    "SELECT value FROM telemetry_meta WHERE key = ?", (SOURCE_WEIGHTS_VERSION_KEY,)
+                ).fetchone()
+                global_rows = self._read_conn.execute("SELECT source_name, weight FROM source_weight").fetchall()
+                area_rows = self._read_conn.execute("SELECT area, source_name, weight FROM source_weight_area").fetchall()
+        by_area: Dict[str, Dict[str, float]] = {}
+        for area, source_name, weight in area_rows:
+            by_area.setdefault(area, {})[source_name] = weight
+        self._weights = {"global": {name: w for name, w in global_rows}, "by_area": by_area}
+        self._weights_version = version_row[0] if version_row else 0
+        now = time.monotonic()
+        self._weights_loaded_at = now
+        self._weights_checked_at = now
+        self.weights_reloads += 1
+        logger.info(f"Source weights loaded (version={self._weights_version}, areas={sorted(by_area)})")
+
+    # Compatibility methods for existing code if needed
+    def get_area_for_query(self, query_id) -> Optional[str]:
+        """Área registrada por el router para un evento (correlation_id)."""
+        if not self.enabled or not query_id or self._read_conn is None:
+            return None
         try:
-            weights = {}
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT source_name, weight FROM source_weight")
-                for row in cursor.fetchall():
-                    weights[row[0]] = row[1]
-            return weights
+            with self._read_lock:
+                row = self._read_conn.execute(
+                    "SELECT area FROM rag_routing WHERE correlation_id = ?", (str(query_id),)
+                ).fetchone()
+            return row[0] if row else None
         except Exception as e:
-            logger.error(f"Error getting source weights: {e}")
-            return {}
+            logger.error(f"Error getting area for query: {e}")
+            return None
 
-    # Compatibility methods for existing code if needed
-    def get_area_for_query(self, query_id):
-        return None 
-        
     def log_sources_for_query(self, query_id, sources):
         pass
 
-telemetry_logger = TelemetryLogger()
+telemetry_logger = TelemetryLogger.instance()
@@ -1,9 +1,16 @@
 import os
+import asyncio
+import json
 import logging
-from typing import Optional, Dict, Any
+import random
+import threading
+from typing import Optional, Dict, Any, List
 
 import httpx
 
+from app.config import settings
+from app.core.executors import io_executor
+
 logger = logging.getLogger(__name__)
 
 API_CORE_URL = os.getenv("API_CORE_BASE_URL", "http://host.docker.internal:4000/api/v1")
@@ -31,7 +38,333 @@ def compute_cost_usd(
     return prompt_tokens * prices["input"] + completion_tokens * prices["output"]
 
 
-async def log_ai_usage(
+class _RejectedBatch(Exception):
+    """El API core rechazó el lote (4xx distinto de 429): reintentar no sirve."""
+
+
+# Marca de fin en la cola para el drain ordenado del shutdown
+_STOP = object()
+
+
+class AIUsageShipper:
+    """
+    Envía los eventos de uso de IA al API core en segundo plano.
+
+    Los eventos se encolan en memoria (cola acotada) y una tarea los agrupa
+    en POSTs de hasta `batch_size` eventos o cada `flush_interval` segundos,
+    sobre un único httpx.AsyncClient con keep-alive. Los 429/5xx y errores de
+    red se reintentan con backoff exponencial con jitter; si el API core sigue
+    sin responder, el lote se guarda en un spool JSONL en disco y se reenvía
+    en cuanto un envío vuelve a funcionar (o al próximo arranque).
+    """
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str],
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        max_retries: int,
+        spool_path: str,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.spool_path = spool_path
+        self.backoff_base = 0.5
+        self.backoff_max = 30.0
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        # Lote en curso: si el drain vence a mitad de un envío, va al spool
+        self._pending: List[Dict[str, Any]] = []
+        # Desborde de la cola llena: se escribe al spool en el io_executor, no en el event loop
+        self._overflow: List[Dict[str, Any]] = []
+        self._overflow_task: Optional[asyncio.Task] = None
+        # Eventos leídos del spool que aún no se reenvían
+        self._replaying: List[Dict[str, Any]] = []
+        self._closing = False
+        self._spool_lock = threading.Lock()
+        # Se apaga si el API core no tiene el endpoint de lotes (404)
+        self._batch_endpoint = True
+        self._warned_no_token = False
+
+        self.enqueued = 0
+        self.sent = 0
+        self.batches = 0
+        self.retries = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+
+    def start(self) -> None:
+        if not self.token or (self._task is not None and not self._task.done()):
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(5.0),
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=2),
+                headers={"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"},
+            )
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, payload: Dict[str, Any]) -> None:
+        """Encola un evento sin bloquear. Con la cola llena (o cerrando) va al spool."""
+        if not self.token:
+            if not self._warned_no_token:
+                logger.warning("SCRAPER_SERVICE_TOKEN not set. Telemetry will not be sent.")
+                self._warned_no_token = True
+            return
+        if self._closing:
+            # Solo durante el shutdown (ya no entran requests): escritura directa
+            self._spill([payload])
+            return
+        self.start()
+        try:
+            self._queue.put_nowait(payload)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            self._overflow.append(payload)
+            if self._overflow_task is None or self._overflow_task.done():
+                self._overflow_task = asyncio.create_task(self._spill_overflow())
+
+    async def _spill_overflow(self) -> None:
+        while self._overflow:
+            events, self._overflow = self._overflow, []
+            await io_executor.run(self._spill, events)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        await self._replay_spool()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            self._pending = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(self._pending) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                self._pending.append(item)
+            try:
+                await self._ship(self._pending)
+            except Exception as e:
+                logger.error(f"Error shipping AI telemetry batch: {e}", exc_info=True)
+                self.last_error = str(e)
+                await io_executor.run(self._spill, self._pending)
+            self._pending = []
+
+    async def _ship(self, batch: List[Dict[str, Any]]) -> None:
+        if await self._deliver(batch):
+            if os.path.exists(self.spool_path):
+                await self._replay_spool()
+        else:
+            await io_executor.run(self._spill, batch)
+
+    async def _post(self, batch: List[Dict[str, Any]]) -> None:
+        """POST del lote; con el fallback evento a evento, `batch` se va vaciando a medida que se envía."""
+        if self._batch_endpoint:
+            resp = await self._client.post(f"{self.base_url}/telemetry/ai-usage/batch", json={"events": batch})
+            if resp.status_code != 404:
+                self._raise_for_status(resp)
+                # El API core valida evento por evento y devuelve los que descartó
+                rejected = resp.json().get("rejected") or []
+                if rejected:
+                    self.rejected += len(rejected)
+                    logger.error(f"API core rejected {len(rejected)}/{len(batch)} AI telemetry events: {rejected[:5]}")
+                self.sent += len(batch) - len(rejected)
+                self.batches += 1
+                batch.clear()
+                return
+            logger.warning("API core has no /telemetry/ai-usage/batch endpoint; sending AI usage events one by one")
+            self._batch_endpoint = False
+
+        while batch:
+            resp = await self._client.post(f"{self.base_url}/telemetry/ai-usage", json=batch[0])
+            if self._is_rejection(resp):
+                # Solo se pierde este evento; el resto del lote sigue
+                self.rejected += 1
+                logger.error(f"API core rejected AI telemetry event (HTTP {resp.status_code}): {resp.text[:500]}")
+            else:
+                resp.raise_for_status()
+                self.sent += 1
+            batch.pop(0)
+        self.batches += 1
+
+    @staticmethod
+    def _is_rejection(resp: httpx.Response) -> bool:
+        return 400 <= resp.status_code < 500 and resp.status_code != 429
+
+    def _raise_for_status(self, resp: httpx.Response) -> None:
+        if self._is_rejection(resp):
+            raise _RejectedBatch(f"HTTP {resp.status_code}: {resp.text[:500]}")
+        resp.raise_for_status()
+
+    async def _deliver(self, batch: List[Dict[str, Any]]) -> bool:
+        """
+        Envía el lote con reintentos. Devuelve False si el API core no
+        respondió después de `max_retries` reintentos (el lote debe ir al spool).
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                # Full jitter, igual que el cliente de Gemini
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))))
+            try:
+                await self._post(batch)
+                self.last_error = None
+                return True
+            except _RejectedBatch as e:
+                logger.error(f"AI telemetry batch rejected, dropping {len(batch)} events: {e}")
+                self.rejected += len(batch)
+                batch.clear()
+                return True
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning(f"Error sending AI telemetry (attempt {attempt + 1}): {self.last_error}")
+        return False
+
+    # --- Spool en disco ---
+
+    def _spill(self, events: List[Dict[str, Any]]) -> None:
+        if not events:
+            return
+        try:
+            with self._spool_lock, open(self.spool_path, "a", encoding="utf-8") as f:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+            self.spilled += len(events)
+        except OSError as e:
+            logger.error(f"Could not spool {len(events)} AI telemetry events, dropping them: {e}")
+
+    def _take_spool(self) -> int:
+        """Mueve el spool a `_replaying` (el archivo se borra). Devuelve cuántos eventos leyó."""
+        with self._spool_lock:
+            try:
+                with open(self.spool_path, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return 0
+            events = []
+            for line in lines:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Línea truncada (p. ej. el proceso murió a mitad de escritura)
+                    continue
+            # Desde acá los eventos solo existen en memoria: stop() los re-guarda si el drain se corta
+            self._replaying = events
+            os.remove(self.spool_path)
+        return len(events)
+
+    async def _replay_spool(self) -> None:
+        if not await io_executor.run(self._take_spool):
+            return
+        logger.info(f"Replaying {len(self._replaying)} spooled AI telemetry events")
+        while self._replaying:
+            chunk = self._replaying[:self.batch_size]
+            size = len(chunk)
+            try:
+                delivered = await self._deliver(chunk)
+            except asyncio.CancelledError:
+                # `chunk` ya no incluye lo que alcanzó a enviarse evento a evento
+                self._replaying = chunk + self._replaying[size:]
+                raise
+            except Exception as e:
+                logger.error(f"Error replaying AI telemetry spool: {e}", exc_info=True)
+                self.last_error = str(e)
+                delivered = False
+            if not delivered:
+                self._replaying = chunk + self._replaying[size:]
+                await io_executor.run(self._spill, self._replaying)
+                self._replaying = []
+                return
+            del self._replaying[:size]
+            self.replayed += size
+
+    # --- Ciclo de vida ---
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Drain ordenado: envía lo encolado y cierra el cliente. Lo que no
+        alcance a salir dentro de `timeout` queda en el spool.
+        """
+        self._closing = True
+        if self._task is not None and not self._task.done():
+            await self._queue.put(_STOP)
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("AI telemetry drain timed out; spooling remaining events")
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            except Exception as e:
+                logger.error(f"AI telemetry shipper failed: {e}")
+        self._task = None
+        if self._overflow_task is not None:
+            await self._overflow_task
+            self._overflow_task = None
+
+        leftover = list(self._pending) + self._replaying + self._overflow
+        self._replaying = []
+        self._overflow = []
+        self._pending = []
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                leftover.append(item)
+        await io_executor.run(self._spill, leftover)
+
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "batches": self.batches,
+            "retries": self.retries,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+        }
+
+
+ai_usage_shipper = AIUsageShipper(
+    base_url=API_CORE_URL,
+    token=SERVICE_AUTH_TOKEN,
+    queue_size=settings.AI_USAGE_QUEUE_SIZE,
+    batch_size=settings.AI_USAGE_BATCH_SIZE,
+    flush_interval=settings.AI_USAGE_FLUSH_INTERVAL_SECONDS,
+    max_retries=settings.AI_USAGE_MAX_RETRIES,
+    spool_path=settings.AI_USAGE_SPOOL_PATH,
+)
+
+
+def log_ai_usage(
     *,
     tenant_id: str,
     user_id: Optional[str],
@@ -47,11 +380,7 @@ async def log_ai_usage(
     source: str = "ai-service",
     metadata: Optional[Dict[str, Any]] = None,
 ) -> None:
-    if not SERVICE_AUTH_TOKEN:
-        logger.warning("SCRAPER_SERVICE_TOKEN not set. Telemetry will not be sent.")
-        return
-
-    url = f"{API_CORE_URL}/telemetry/ai-usage"
+    """Encola un evento de uso de IA; lo envía ai_usage_shipper en lote (no bloquea)."""
     payload = {
         "tenantId": tenant_id,
         "userId": user_id,
@@ -67,18 +396,4 @@ async def log_ai_usage(
         "source": source,
         "metadata": metadata or {},
     }
-
-    headers = {
-        "Authorization": f"Bearer {SERVICE_AUTH_TOKEN}",
-        "Content-Type": "application/json",
-    }
-
-    try:
-        async with httpx.AsyncClient(timeout=3.0) as client:
-            resp = await client.post(url, json=payload, headers=headers)
-            if resp.status_code >= 400:
-                logger.error(
-                    f"Failed to send AI telemetry ({resp.status_code}): {resp.text}"
-                )
-    except Exception as e:
-        logger.error(f"Error sending AI telemetry: {e}", exc_info=True)
+    ai_usage_shipper.enqueue(payload)
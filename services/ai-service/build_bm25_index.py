@@ -0,0 +1,27 @@
+import logging
+import sys
+from app.core.rag.knowledge_base import knowledge_base
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Colecciones locales que participan en la búsqueda híbrida
+COLLECTIONS = ["practica_forense", "libros", "jurisprudencia", "legislacion", "doctrina"]
+
+def main():
+    """
+    Reconstruye el índice BM25 a partir de los documentos ya guardados en Chroma.
+    Necesario una vez para colecciones indexadas antes de la búsqueda híbrida;
+    después, add_documents lo mantiene al día de forma incremental.
+    """
+    if knowledge_base.lexical_index is None:
+        logger.warning("HYBRID_SEARCH_ENABLED is false, nothing to build.")
+        return
+
+    collections = sys.argv[1:] or COLLECTIONS
+    for name in collections:
+        total = knowledge_base.rebuild_lexical_index(name)
+        logger.info(f"{name}: {total} documents indexed")
+
+if __name__ == "__main__":
+    main()
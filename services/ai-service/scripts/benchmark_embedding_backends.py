@@ -0,0 +1,98 @@
+import argparse
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.core.rag.embedding_backends import (
+    OnnxEmbeddingBackend,
+    TorchEmbeddingBackend,
+    export_onnx_model,
+)
+
+SAMPLE_TEXTS = [
+    "plazo para contestar demanda ejecutiva",
+    "artículo 1698 del Código Civil, carga de la prueba de las obligaciones",
+    "Ley 18.010 sobre operaciones de crédito de dinero, intereses máximos",
+    "recurso de protección por vulneración de derechos fundamentales",
+    "responsabilidad civil extracontractual por daño moral",
+    "despido injustificado y cálculo de indemnización por años de servicio",
+    "abandono del procedimiento en juicio ordinario de mayor cuantía",
+    "ROL C-123-2024 sentencia Corte de Apelaciones de Santiago",
+]
+
+
+def load_texts(path: str | None, n: int) -> list[str]:
+    if path:
+        lines = [l.strip() for l in Path(path).read_text(encoding="utf-8").splitlines() if l.strip()]
+    else:
+        lines = SAMPLE_TEXTS
+    return [lines[i % len(lines)] for i in range(n)]
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss viene en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench(backend, texts: list[str], batch_size: int, repeats: int) -> tuple[np.ndarray, float]:
+    backend.encode(texts[:batch_size], batch_size=batch_size)  # warmup
+    start = time.perf_counter()
+    for _ in range(repeats):
+        vectors = backend.encode(texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    return np.asarray(vectors), (len(texts) * repeats) / elapsed
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara throughput y drift coseno torch vs ONNX.")
+    parser.add_argument("--texts", help="Archivo con un texto por línea (opcional)")
+    parser.add_argument("-n", type=int, default=256, help="Cantidad de textos a codificar")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--onnx-dir", default=settings.EMBEDDING_ONNX_DIR)
+    parser.add_argument("--export", action="store_true", help="Re-exportar el modelo ONNX antes de medir")
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts, args.n)
+    onnx_dir = Path(args.onnx_dir)
+
+    if args.export or not (onnx_dir / "embedding_config.json").exists():
+        print(f"Exporting {settings.EMBEDDING_MODEL} to {onnx_dir}...")
+        export_onnx_model(settings.EMBEDDING_MODEL, str(onnx_dir), quantize=True)
+
+    rss_start = max_rss_mb()
+    torch_backend = TorchEmbeddingBackend(settings.EMBEDDING_MODEL)
+    rss_torch = max_rss_mb() - rss_start
+    ref, torch_tps = bench(torch_backend, texts, args.batch_size, args.repeats)
+    print(f"torch        : {torch_tps:8.1f} textos/s  (+{rss_torch:.0f} MB RSS al cargar)")
+
+    for quantized in (False, True):
+        label = "onnx int8" if quantized else "onnx fp32"
+        rss_before = max_rss_mb()
+        backend = OnnxEmbeddingBackend(str(onnx_dir), quantized=quantized)
+        rss_delta = max_rss_mb() - rss_before
+        vectors, tps = bench(backend, texts, args.batch_size, args.repeats)
+        cos = cosine_rows(ref, vectors)
+        print(
+            f"{label:13}: {tps:8.1f} textos/s  speedup x{tps / torch_tps:.2f}  "
+            f"cos medio={cos.mean():.4f} min={cos.min():.4f}  (+{rss_delta:.0f} MB RSS)"
+        )
+
+    print("Nota: RSS es el máximo del proceso; para comparar memoria residente real, "
+          "ejecutar cada backend en un proceso separado.")
+
+
+if __name__ == "__main__":
+    main()
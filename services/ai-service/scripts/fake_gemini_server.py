@@ -0,0 +1,68 @@
+"""
+Servidor Gemini falso para pruebas locales del cliente (sin costo ni API key).
+
+Imita `:generateContent` y `:streamGenerateContent?alt=sse` de la API v1beta
+y permite inyectar fallas:
+  FAKE_GEMINI_FAIL_FIRST=N     -> las primeras N llamadas devuelven FAKE_GEMINI_FAIL_STATUS
+  FAKE_GEMINI_FAIL_STATUS=503  -> status de las fallas inyectadas (429, 500, 503...)
+  FAKE_GEMINI_DELAY_MS=0       -> latencia artificial por llamada
+
+Uso:
+  uvicorn scripts.fake_gemini_server:app --port 8089
+  GEMINI_ENDPOINT=http://localhost:8089/v1beta/models GEMINI_HTTP2=false uvicorn app.main:app
+"""
+import asyncio
+import json
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake Gemini")
+
+FAIL_FIRST = int(os.environ.get("FAKE_GEMINI_FAIL_FIRST", 0))
+FAIL_STATUS = int(os.environ.get("FAKE_GEMINI_FAIL_STATUS", 503))
+DELAY_MS = int(os.environ.get("FAKE_GEMINI_DELAY_MS", 0))
+
+state = {"calls": 0}
+
+def _prompt_text(payload: dict) -> str:
+    try:
+        return payload["contents"][-1]["parts"][0]["text"]
+    except (KeyError, IndexError):
+        return ""
+
+def _fake_answer(prompt: str) -> str:
+    question = prompt.rsplit("User Query:", 1)[-1].strip()
+    return f"Respuesta simulada para: {question[:200]}"
+
+@app.post("/v1beta/models/{model_action}")
+async def generate_content(model_action: str, request: Request):
+    state["calls"] += 1
+    if DELAY_MS:
+        await asyncio.sleep(DELAY_MS / 1000)
+    if state["calls"] <= FAIL_FIRST:
+        return JSONResponse(status_code=FAIL_STATUS, content={"error": {"code": FAIL_STATUS, "message": "injected failure"}})
+
+    payload = await request.json()
+    text = _fake_answer(_prompt_text(payload))
+    if model_action.endswith(":streamGenerateContent"):
+        return StreamingResponse(_sse_chunks(text), media_type="text/event-stream")
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": len(_prompt_text(payload)) // 4, "candidatesTokenCount": len(text) // 4},
+    }
+
+async def _sse_chunks(text: str):
+    words = text.split(" ")
+    for i, word in enumerate(words):
+        piece = word if i == 0 else f" {word}"
+        chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}]}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n"
+        await asyncio.sleep(0.01)
+    done = {"candidates": [{"finishReason": "STOP"}]}
+    yield f"data: {json.dumps(done)}\r\n\r\n"
+
+@app.get("/_calls")
+def calls():
+    return state
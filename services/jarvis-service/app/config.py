@@ -12,6 +12,16 @@ if env_path.exists():
 # --- GEMINI ---
 GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
 GEMINI_MODEL_NAME: str = os.getenv("GEMINI_MODEL_NAME", "gemini-2.0-flash")
+GEMINI_BASE_URL: str = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/models")
+GEMINI_TIMEOUT_SECONDS: float = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+GEMINI_MAX_RETRIES: int = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+
+# Cache de respuestas de LLM por hash del prompt (solo llamadas de baja temperatura)
+LLM_CACHE_ENABLED: bool = os.getenv("JARVIS_LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_DB_PATH: str = os.getenv("JARVIS_LLM_CACHE_DB", str(BASE_DIR / "llm_cache.db"))
+LLM_CACHE_TTL_SECONDS: int = int(os.getenv("JARVIS_LLM_CACHE_TTL_SECONDS", str(30 * 86400)))
+LLM_CACHE_MAX_ENTRIES: int = int(os.getenv("JARVIS_LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_MAX_TEMPERATURE: float = float(os.getenv("JARVIS_LLM_CACHE_MAX_TEMPERATURE", "0.2"))
 
 if not GEMINI_API_KEY:
     # Warning instead of error to allow build without env vars
@@ -26,6 +36,9 @@ EMBEDDING_MODEL_NAME: str = os.getenv(
 
 TOP_K_RESULTS: int = int(os.getenv("JARVIS_TOP_K_RESULTS", "5"))
 
+# Cache persistente de embeddings de chunks (hash(modelo, texto) -> vector)
+EMBEDDING_STORE_PATH: str = os.getenv("JARVIS_EMBEDDING_STORE", str(BASE_DIR / "embedding_store.db"))
+
 
 
 # --- GENERAL ---
@@ -1,22 +1,102 @@
-import requests
-from typing import List, Dict, Any
-from app.config import GEMINI_API_KEY, GEMINI_MODEL_NAME
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import List, Dict, Any, Optional
 
-GEMINI_ENDPOINT = (
-    f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL_NAME}:generateContent"
+import httpx
+
+from app.config import (
+    GEMINI_API_KEY,
+    GEMINI_BASE_URL,
+    GEMINI_MAX_RETRIES,
+    GEMINI_MODEL_NAME,
+    GEMINI_TIMEOUT_SECONDS,
 )
+from .llm_cache import llm_cache, llm_cache_key
+
+logger = logging.getLogger(__name__)
+
+GEMINI_ENDPOINT = f"{GEMINI_BASE_URL}/{GEMINI_MODEL_NAME}:generateContent"
+
+# Status HTTP que vale la pena reintentar
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
 
 
 class GeminiClient:
     def __init__(self, api_key: str = GEMINI_API_KEY):
         self.api_key = api_key
+        self._client: Optional[httpx.AsyncClient] = None
+        # Latencia de cada intento: {"attempt", "status", "latency_ms"}
+        self.attempts: deque = deque(maxlen=500)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Cliente compartido: HTTP/2 + keep-alive, sin handshake TLS por pregunta
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
-    def generate_answer(
+    async def _post_with_retries(self, url: str, payload: Dict[str, Any], deadline_seconds: float) -> httpx.Response:
+        """POST con backoff exponencial con jitter en 429/5xx, dentro de un deadline total."""
+        client = self._get_client()
+        deadline = time.monotonic() + deadline_seconds
+        last_error = "deadline exceeded"
+
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            started = time.perf_counter()
+            retry_after = None
+            status = None
+            try:
+                resp = await client.post(url, json=payload, timeout=remaining)
+                status = resp.status_code
+                if status not in RETRYABLE_STATUS:
+                    resp.raise_for_status()
+                    return resp
+                last_error = f"HTTP {status}"
+                retry_after = resp.headers.get("Retry-After")
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                last_error = f"{type(e).__name__}: {e}"
+            finally:
+                self.attempts.append({
+                    "attempt": attempt,
+                    "status": status,
+                    "latency_ms": int((time.perf_counter() - started) * 1000),
+                })
+
+            if attempt == GEMINI_MAX_RETRIES:
+                break
+            cap = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+            delay = random.uniform(0, cap)
+            if retry_after and retry_after.isdigit():
+                delay = min(float(retry_after), BACKOFF_MAX_SECONDS)
+            if time.monotonic() + delay >= deadline:
+                break
+            logger.warning(f"Gemini attempt {attempt} failed ({last_error}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        raise RuntimeError(f"Gemini call failed: {last_error}")
+
+    async def generate_answer(
         self,
         question: str,
         context_chunks: List[Dict[str, Any]],
         temperature: float = 0.7,
         max_output_tokens: int = 1024,
+        deadline_seconds: float = GEMINI_TIMEOUT_SECONDS,
     ) -> Dict[str, Any]:
         """
         Envía un prompt estructurado a Gemini con contexto (RAG).
@@ -68,13 +148,23 @@ class GeminiClient:
                 "raw": {"error": "Missing API Key"}
             }
 
+        # Mismo prompt a baja temperatura (p.ej. re-subir el mismo escrito) -> respuesta cacheada
+        cache_key = None
+        if llm_cache.is_cacheable(temperature):
+            cache_key = llm_cache_key(
+                "gemini", GEMINI_MODEL_NAME, payload["contents"], temperature, None,
+                max_output_tokens=max_output_tokens,
+            )
+            cached = await asyncio.to_thread(llm_cache.get, cache_key)
+            if cached is not None:
+                return {"answer": cached, "raw": {"cached": True}}
+
         try:
-            resp = requests.post(
+            resp = await self._post_with_retries(
                 f"{GEMINI_ENDPOINT}?key={self.api_key}",
-                json=payload,
-                timeout=60,
+                payload,
+                deadline_seconds,
             )
-            resp.raise_for_status()
             data = resp.json()
 
             answer = (
@@ -85,10 +175,12 @@ class GeminiClient:
                 .strip()
             )
 
+            if cache_key is not None and answer:
+                await asyncio.to_thread(llm_cache.set, cache_key, "gemini", GEMINI_MODEL_NAME, answer)
             return {"answer": answer, "raw": data}
         
         except Exception as e:
-            print(f"Gemini API Error: {e}")
+            logger.error(f"Gemini API Error: {e}")
             return {
                 "answer": f"Lo siento, ocurrió un error al consultar a mi cerebro (Gemini): {str(e)}",
                 "raw": {"error": str(e)}
@@ -0,0 +1,158 @@
+# Copia deliberada de services/ai-service/app/core/ai/llm_cache.py: cada servicio se construye como imagen
+# independiente (sin paquete Python compartido). Solo difiere la lectura de
+# config; cualquier cambio se aplica en ambos archivos.
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.config import (
+    LLM_CACHE_DB_PATH,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_MAX_TEMPERATURE,
+    LLM_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def llm_cache_key(
+    provider: str,
+    model: str,
+    messages: Any,
+    temperature: float,
+    response_format: Optional[Any] = None,
+    **params: Any,
+) -> str:
+    """sha256 de (proveedor, modelo, mensajes, temperatura, formato de respuesta, otros parámetros)."""
+    raw = json.dumps(
+        [provider, model, messages, round(float(temperature), 4), response_format, params],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Cache local de respuestas de LLM (OpenAI / Gemini) indexado por hash del prompt.
+
+    Solo tiene sentido para llamadas casi deterministas: `is_cacheable` deja
+    fuera las de temperatura sobre `max_temperature`. Las entradas vencen por
+    TTL y, sobre `max_entries`, se eliminan las menos usadas recientemente.
+    """
+    def __init__(self, db_path: str, ttl_seconds: int, max_entries: int, max_temperature: float, enabled: bool = True):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_temperature = max_temperature
+        self.enabled = enabled
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                cache_key TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_response_cache (last_accessed_at)")
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+
+    def is_cacheable(self, temperature: float) -> bool:
+        return self.enabled and temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT response FROM llm_response_cache WHERE cache_key = ? AND created_at >= ?",
+                    (key, now - self.ttl_seconds),
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._conn.execute(
+                    "UPDATE llm_response_cache SET last_accessed_at = ?, hits = hits + 1 WHERE cache_key = ?",
+                    (now, key),
+                )
+                self._conn.commit()
+                self.hits += 1
+            return json.loads(row[0])
+        except Exception as e:
+            logger.error(f"Error reading LLM cache: {e}")
+            return None
+
+    def set(self, key: str, provider: str, model: str, response: Any) -> None:
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO llm_response_cache
+                        (cache_key, provider, model, response, created_at, last_accessed_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, provider, model, json.dumps(response, ensure_ascii=False, default=str), now, now),
+                )
+                self._writes_since_evict += 1
+                # La evicción se hace cada tanto, no en cada escritura
+                if self._writes_since_evict >= 50:
+                    self._evict(now)
+                    self._writes_since_evict = 0
+                self._conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing LLM cache: {e}")
+
+    def _evict(self, now: float) -> None:
+        # Llamar con el lock tomado
+        self._conn.execute("DELETE FROM llm_response_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            """
+            DELETE FROM llm_response_cache WHERE cache_key IN (
+                SELECT cache_key FROM llm_response_cache
+                ORDER BY last_accessed_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "max_temperature": self.max_temperature,
+        }
+
+
+llm_cache = LLMResponseCache(
+    db_path=LLM_CACHE_DB_PATH,
+    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    max_temperature=LLM_CACHE_MAX_TEMPERATURE,
+    enabled=LLM_CACHE_ENABLED,
+)
@@ -5,7 +5,8 @@ import chromadb
 from chromadb.utils import embedding_functions
 from sentence_transformers import SentenceTransformer
 from PyPDF2 import PdfReader
-from app.config import CHROMA_PERSIST_DIR, EMBEDDING_MODEL_NAME
+from app.config import CHROMA_PERSIST_DIR, EMBEDDING_MODEL_NAME, EMBEDDING_STORE_PATH
+from app.core.rag.embedding_store import EmbeddingStore
 
 # Local Data Path inside container
 DATA_DIR = "/app/data/templates"
@@ -85,6 +86,7 @@ def run_ingestion():
             model_name=EMBEDDING_MODEL_NAME
         )
         collection = client.get_or_create_collection(name="libros", embedding_function=embedding_fn)
+        store = EmbeddingStore(EMBEDDING_STORE_PATH)
     except Exception as e:
         print(f"Chroma Init Error: {e}")
         return
@@ -123,7 +125,9 @@ def run_ingestion():
             ids = [f"{f}-{i}" for i in range(len(chunks))]
             metadatas = [{"source": f, "page_chunk": i, "type": "book"} for i in range(len(chunks))]
             try:
-                collection.upsert(documents=chunks, metadatas=metadatas, ids=ids)
+                # Solo se codifican los chunks cuyo texto no está en el store
+                embeddings = store.embed(EMBEDDING_MODEL_NAME, chunks, lambda texts: [[float(x) for x in v] for v in embedding_fn(texts)])
+                collection.upsert(documents=chunks, embeddings=embeddings, metadatas=metadatas, ids=ids)
                 chunks_total += len(chunks)
                 count += 1
             except Exception as e:
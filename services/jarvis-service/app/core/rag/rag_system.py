@@ -1,3 +1,4 @@
+import asyncio
 from typing import Dict, Any, List
 from .knowledge_base import knowledge_base
 from ..ai.gemini_client import GeminiClient
@@ -11,13 +12,18 @@ class RAGSystem:
         self.kb = knowledge_base
         self.scielo = scielo_scraper
 
-    def answer_question(self, question: str, extra_context: str | None = None) -> Dict[str, Any]:
-        # 1) Buscar en KB Local (ChromaDB)
-        kb_results = self.kb.search(question, collection_name="libros", limit=3)
-        # kb_results = []
-        
-        # 2) Buscar en SciELO (Web Scraper)
-        scielo_results = self.scielo.search(question, limit=3)
+    async def answer_question(
+        self,
+        question: str,
+        extra_context: str | None = None,
+        temperature: float = 0.7,
+    ) -> Dict[str, Any]:
+        # 1) Buscar en KB Local (ChromaDB) y 2) en SciELO (Web Scraper), en paralelo
+        # y fuera del event loop (ambas llamadas son bloqueantes)
+        kb_results, scielo_results = await asyncio.gather(
+            asyncio.to_thread(self.kb.search, question, collection_name="libros", top_k=3),
+            asyncio.to_thread(self.scielo.search, question, limit=3),
+        )
         
         # Convertir resultados de SciELO a formato chunk para el LLM
         scielo_chunks = []
@@ -54,7 +60,7 @@ class RAGSystem:
             )
 
         # 4) Llamamos a Gemini con estos chunks
-        gemini_result = gemini_client.generate_answer(question, context_chunks)
+        gemini_result = await gemini_client.generate_answer(question, context_chunks, temperature=temperature)
 
         # 5) Construimos estructura para el frontend (fuentes con relevancia)
         sources = []
@@ -3,7 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
 from .config import SERVICE_NAME, DEBUG
-from .core.rag.rag_system import rag_system
+from .core.rag.rag_system import rag_system, gemini_client
 import time
 
 app = FastAPI(
@@ -43,6 +43,11 @@ class TTSResponse(BaseModel):
     audioUrl: str
 
 
+@app.on_event("shutdown")
+async def close_clients():
+    await gemini_client.aclose()
+
+
 @app.get("/health")
 def health():
     return {
@@ -53,12 +58,12 @@ def health():
 
 
 @app.post("/ask", response_model=AskResponse)
-def ask_jarvis(body: AskRequest):
+async def ask_jarvis(body: AskRequest):
     """
     Endpoint principal: RAG + Gemini.
     """
     try:
-        rag_result = rag_system.answer_question(body.question, body.extra_context)
+        rag_result = await rag_system.answer_question(body.question, body.extra_context)
 
         return AskResponse(
             answer=rag_result["answer"],
@@ -97,7 +102,8 @@ async def analyze_document(
         NO incluyas markdown, solo el JSON raw.
         """
         
-        rag_result = rag_system.answer_question(question, extra_context=text)
+        # Extracción estructurada: baja temperatura (determinista y cacheable por prompt)
+        rag_result = await rag_system.answer_question(question, extra_context=text, temperature=0.1)
         answer = rag_result["answer"]
         
         placeholders_found = {}